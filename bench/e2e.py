@@ -0,0 +1,458 @@
+"""
+Benchmark end-to-end offline: Pexels, Openverse y Hugging Face se reemplazan
+por un servidor HTTP local (JSON enlatado + media sintética hecha con ffmpeg),
+las voces son sintéticas (15/30/60 s) con transcripción enlatada.
+
+    python bench/e2e.py                                  # todas las voces, cache frío y tibio
+    python bench/e2e.py --lengths 30 --compositor ffmpeg --out nuevo.json
+    python bench/e2e.py --compare viejo.json nuevo.json  # diferencias entre corridas
+    python bench/e2e.py --fake-embeddings --latency-ms 80
+    python bench/e2e.py --fake-embeddings --library 40   # biblioteca propia antes de Pexels
+    python bench/e2e.py --hf-delay stabilityai/stable-diffusion-xl-base-1.0=30   # hedge de modelos IA
+
+Cada render corre en un proceso aparte (RSS pico propio) con SHORTAUTO_CACHE
+aislado: "cold" arranca con el cache vacío y "warm" reusa el del cold.
+Resultado: JSON con tiempo total, tiempo por etapa (spans de src/tracing),
+RSS pico y bytes servidos por los stand-ins.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = ROOT / ".bench"
+
+LENGTHS = (15, 30, 60)
+VIDEO_SIZES = ((720, 1280), (1080, 1920), (1440, 2560))  # renditions que ofrece el stand-in
+VIDEO_DUR = 8  # s de cada video sintético
+WORDS = """sangre glucosa laboratorio corazón energía cerebro músculo proteína azúcar
+insulina hígado riñón pulmones oxígeno vitamina hierro calcio hueso célula agua sueño
+ejercicio comida fruta verdura cuerpo médico análisis resultado salud ciudad noche""".split()
+
+
+def ff(*args):
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", *map(str, args)], check=True)
+
+
+# ---------------------------
+# Fixtures (se generan una vez)
+# ---------------------------
+
+def canned_transcript(length, seed):
+    # segmentos de 1.5–3 s con palabras y tiempos por palabra (como transcribe())
+    rnd = random.Random(seed)
+    segs, t = [], 0.3
+    while t < length - 1.0:
+        dur = min(rnd.uniform(1.5, 3.0), length - t)
+        words = rnd.sample(WORDS, rnd.randint(3, 7))
+        step = dur / len(words)
+        segs.append({
+            "start": round(t, 3), "end": round(t + dur, 3), "text": " ".join(words),
+            "words": [{"start": round(t + i * step, 3), "end": round(t + (i + 1) * step, 3),
+                       "word": " " + w} for i, w in enumerate(words)],
+        })
+        t += dur + rnd.uniform(0.05, 0.3)
+    return segs
+
+
+def make_fixtures(lengths):
+    fx = BENCH_DIR / "fixtures"
+    (fx / "media").mkdir(parents=True, exist_ok=True)
+    for w, h in VIDEO_SIZES:
+        p = fx / "media" / f"video_{w}x{h}.mp4"
+        if not p.exists():
+            ff("-f", "lavfi", "-i", f"testsrc2=s={w}x{h}:r=30:d={VIDEO_DUR}",
+               "-c:v", "libx264", "-pix_fmt", "yuv420p", "-movflags", "+faststart", p)
+    if not (fx / "media" / "photo.jpg").exists():
+        ff("-f", "lavfi", "-i", "testsrc2=s=1200x1800", "-frames:v", 1, fx / "media" / "photo.jpg")
+    if not (fx / "media" / "ia.png").exists():
+        ff("-f", "lavfi", "-i", "mandelbrot=s=1024x1792", "-frames:v", 1, fx / "media" / "ia.png")
+    if not (fx / "media" / "music.mp3").exists():
+        ff("-f", "lavfi", "-i", "sine=frequency=110:duration=60", "-f", "lavfi",
+           "-i", "sine=frequency=165:duration=60", "-filter_complex", "amix=inputs=2",
+           "-b:a", "128k", fx / "media" / "music.mp3")
+    voices = []
+    for n in lengths:
+        audio = fx / f"voice_{n}s.mp3"
+        if not audio.exists():
+            # tono + ruido rosa: la transcripción viene enlatada (Whisper no entiende esto)
+            ff("-f", "lavfi", "-i", f"sine=frequency=190:duration={n}", "-f", "lavfi",
+               "-i", f"anoisesrc=d={n}:c=pink:a=0.03", "-filter_complex", "amix=inputs=2",
+               "-ac", 1, "-ar", 24000, "-b:a", "64k", audio)
+        tr = audio.with_suffix(".json")
+        if not tr.exists():
+            tr.write_text(json.dumps(canned_transcript(n, seed=n), ensure_ascii=False),
+                          encoding="utf-8")
+        voices.append({"name": f"voice_{n}s", "audio": str(audio), "transcript": str(tr)})
+    return fx, voices
+
+
+def make_library(fx, n):
+    """Biblioteca propia sintética: n clips con un .txt de 2-4 palabras del vocabulario."""
+    lib = fx / "library"
+    lib.mkdir(parents=True, exist_ok=True)
+    src = fx / "media" / "video_1080x1920.mp4"  # cubre W x H: la biblioteca no acepta menos
+    rnd = random.Random(n)
+    for i in range(n):
+        p = lib / f"clip_{i:03d}.mp4"
+        if not p.exists():
+            shutil.copyfile(src, p)
+            p.with_suffix(".txt").write_text(" ".join(rnd.sample(WORDS, rnd.randint(2, 4))),
+                                             encoding="utf-8")
+    return lib
+
+
+# ---------------------------
+# Stand-ins HTTP
+# ---------------------------
+
+class StandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, media_dir, latency_s=0.0, hf_delay=None, hf_warmup=None):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.media_dir = Path(media_dir)
+        self.latency_s = latency_s
+        self.hf_delay = dict(hf_delay or {})    # modelo -> s extra por imagen
+        self.hf_warmup = dict(hf_warmup or {})  # modelo -> cuántos 503 "warming-up" antes de responder
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def reset(self):
+        with self.lock:
+            self.stats = {"requests": 0, "bytes": 0, "by_route": {}}
+
+    def count(self, route, nbytes):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += nbytes
+            r = self.stats["by_route"].setdefault(route, {"requests": 0, "bytes": 0})
+            r["requests"] += 1
+            r["bytes"] += nbytes
+
+
+def _qid(q, k):
+    return int(hashlib.sha1(f"{q}|{k}".encode("utf-8")).hexdigest()[:8], 16)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, route, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(route, len(body))
+
+    def _file(self, route, path, head=False):
+        size = path.stat().st_size
+        m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        start, end = 0, size - 1
+        if m:
+            start = int(m[1])
+            end = min(int(m[2]), size - 1) if m[2] else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_response(206 if m else 200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if m:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head:
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            left = end - start + 1
+            while left > 0:
+                chunk = f.read(min(left, 1 << 20))
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    break  # el cliente cortó (descarga parcial)
+                left -= len(chunk)
+                self.server.count(route, len(chunk))
+
+    def _media(self, path):
+        media = self.server.media_dir
+        if path.startswith("/media/video/"):
+            return "pexels_video_file", media / f"video_{path.rsplit('/', 1)[1]}"
+        if path.startswith("/media/photo/"):
+            return "pexels_photo_file", media / "photo.jpg"
+        if path.startswith("/media/music/"):
+            return "openverse_file", media / "music.mp3"
+        return None, None
+
+    def do_HEAD(self):
+        route, path = self._media(urlparse(self.path).path)
+        if path is None:
+            self.send_error(404)
+            return
+        self._file(route, path, head=True)
+
+    def do_GET(self):
+        time.sleep(self.server.latency_s)
+        url = urlparse(self.path)
+        q = (parse_qs(url.query).get("query") or parse_qs(url.query).get("q") or [""])[0]
+        n = int((parse_qs(url.query).get("per_page") or ["5"])[0])
+        base = self.server.base
+        if url.path == "/pexels/videos/search":
+            vids = []
+            for k in range(n):
+                vid = _qid(q, k)
+                vids.append({"id": vid, "duration": VIDEO_DUR, "video_files": [
+                    {"file_type": "video/mp4", "width": w, "height": h,
+                     "link": f"{base}/media/video/{vid}/{w}x{h}.mp4"} for w, h in VIDEO_SIZES]})
+            return self._json("pexels_videos_search", {"videos": vids})
+        if url.path == "/pexels/v1/search":
+            photos = [{"src": {"large2x": f"{base}/media/photo/{_qid(q, k)}.jpg"}} for k in range(n)]
+            return self._json("pexels_photos_search", {"photos": photos})
+        if url.path == "/openverse/v1/audio/":
+            res = [{"title": f"bench {k}", "creator": "bench", "license": "by", "duration": 60000,
+                    "url": f"{base}/media/music/{_qid(q, k)}.mp3"} for k in range(10)]
+            return self._json("openverse_audio_search", {"results": res})
+        route, path = self._media(url.path)
+        if path is None:
+            self.send_error(404)
+            return
+        self._file(route, path)
+
+    def do_POST(self):
+        time.sleep(self.server.latency_s)
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        url = urlparse(self.path)
+        if url.path == "/openverse/v1/auth_tokens/token/":
+            return self._json("openverse_token", {"access_token": "bench", "expires_in": 3600})
+        if url.path.startswith("/hf/models/"):
+            model = url.path[len("/hf/models/"):]
+            with self.server.lock:
+                warming = self.server.hf_warmup.get(model, 0) > 0
+                if warming:
+                    self.server.hf_warmup[model] -= 1
+            if warming:
+                body = json.dumps({"error": "loading", "estimated_time": 3}).encode("utf-8")
+                self.send_response(503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                self.server.count("hf_503", len(body))
+                return
+            time.sleep(self.server.hf_delay.get(model, 0.0))
+            return self._file("hf_image", self.server.media_dir / "ia.png")
+        self.send_error(404)
+
+
+# ---------------------------
+# Un render (proceso hijo)
+# ---------------------------
+
+class _HashEncoder:
+    # reemplazo determinista de MiniLM (--fake-embeddings): trigramas hasheados, dim 384
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True, batch_size=64):
+        import numpy as np
+        out = np.zeros((len(texts), 384), dtype=np.float32)
+        for i, t in enumerate(texts):
+            t = f"  {t.lower()} "
+            for j in range(len(t) - 2):
+                out[i, int(hashlib.md5(t[j:j + 3].encode("utf-8")).hexdigest()[:6], 16) % 384] += 1
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-6)
+
+
+def child(spec):
+    sys.path.insert(0, str(ROOT))
+    import build_short
+    from src import transcribe as tr
+    from src.tracing import tracing, span
+
+    # transcripción enlatada en el cache (misma clave que usaría build_short)
+    key = tr.transcript_key(spec["audio"], build_short.WHISPER_MODEL, build_short.LANG, "int8", True)
+    path = tr.TRANSCRIPT_DIR / f"{key}.json"
+    if not path.exists():
+        segs = json.loads(Path(spec["transcript"]).read_text(encoding="utf-8"))
+        tr.write_atomic(path, json.dumps({"key": key, "audio": spec["audio"], "segments": segs}))
+    if spec.get("fake_embeddings"):
+        import src.embeddings as emb
+        emb._EMB_MODEL = _HashEncoder()
+
+    if spec.get("library"):
+        from src.library import build_index
+        build_index()  # paso offline: fuera del tiempo medido (el cold lo rearma)
+
+    out = Path(spec["run_dir"]) / "short.mp4"
+    t0 = time.perf_counter()
+    with tracing(str(out.with_suffix(".trace.json")), name=spec["name"]) as trace:
+        with span("render"):
+            build_short.render_short(spec["audio"], str(out), spec["run_dir"], **spec["options"])
+    wall = time.perf_counter() - t0
+    res = {"wall_s": round(wall, 3),
+           "stages": {k: {"n": v["n"], "total_s": round(v["total_s"], 3), "bytes": v["bytes"],
+                          "hit": v["hit"], "miss": v["miss"]}
+                      for k, v in trace.summary().items()}}
+    try:
+        import resource
+        # ru_maxrss: KB en Linux, bytes en macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        res["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6, 1)
+        res["peak_rss_children_mb"] = round(
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 1e6, 1)
+    except ImportError:
+        pass
+    Path(spec["result"]).write_text(json.dumps(res), encoding="utf-8")
+
+
+def run_one(server, voice, mode, cache_dir, args):
+    run_dir = BENCH_DIR / "runs" / f"{voice['name']}-{mode}"
+    shutil.rmtree(run_dir, ignore_errors=True)
+    run_dir.mkdir(parents=True)
+    spec = {"name": f"{voice['name']}-{mode}", "audio": voice["audio"],
+            "transcript": voice["transcript"], "run_dir": str(run_dir),
+            "result": str(run_dir / "result.json"), "fake_embeddings": args.fake_embeddings,
+            "library": bool(args.library),
+            "options": {"single_pass": args.single_pass, "compositor": args.compositor}}
+    env = dict(os.environ,
+               SHORTAUTO_CACHE=str(cache_dir), HOME=str(BENCH_DIR / "home"),
+               PEXELS_API_BASE=f"{server.base}/pexels", PEXELS_API_KEY="bench",
+               OPENVERSE_API_BASE=f"{server.base}/openverse",
+               OPENVERSE_CLIENT_ID="bench", OPENVERSE_CLIENT_SECRET="bench",
+               HF_API_BASE=f"{server.base}/hf", HF_TOKEN="bench",
+               BROLL_LIBRARY=str(BENCH_DIR / "fixtures" / "library"))
+    (BENCH_DIR / "home").mkdir(parents=True, exist_ok=True)
+    server.reset()
+    t0 = time.perf_counter()
+    r = subprocess.run([sys.executable, __file__, "--child", json.dumps(spec)], cwd=run_dir,
+                       env=env, capture_output=not args.verbose, text=True)
+    elapsed = time.perf_counter() - t0
+    res = {"fixture": voice["name"], "mode": mode, "ok": r.returncode == 0,
+           "process_s": round(elapsed, 3), "network": dict(server.stats)}
+    if r.returncode == 0:
+        res.update(json.loads((run_dir / "result.json").read_text(encoding="utf-8")))
+    else:
+        res["error"] = (r.stderr or "")[-2000:]
+    return res
+
+
+# ---------------------------
+# Comparación
+# ---------------------------
+
+def compare(old_path, new_path):
+    old = {(r["fixture"], r["mode"]): r for r in json.loads(Path(old_path).read_text())["runs"]}
+    new = {(r["fixture"], r["mode"]): r for r in json.loads(Path(new_path).read_text())["runs"]}
+
+    def delta(a, b):
+        return f"{b - a:+.2f} ({(b - a) / a * 100:+.0f}%)" if a else f"{b - a:+.2f}"
+
+    for k in sorted(set(old) & set(new)):
+        o, n = old[k], new[k]
+        if not (o.get("ok") and n.get("ok")):
+            print(f"{k[0]}/{k[1]}: sin datos (falló una corrida)")
+            continue
+        print(f"{k[0]}/{k[1]}: total {o['wall_s']:.2f}s -> {n['wall_s']:.2f}s {delta(o['wall_s'], n['wall_s'])}"
+              f"  RSS {o.get('peak_rss_mb')} -> {n.get('peak_rss_mb')} MB"
+              f"  red {o['network']['bytes'] / 1e6:.1f} -> {n['network']['bytes'] / 1e6:.1f} MB")
+        for st in sorted(set(o["stages"]) | set(n["stages"])):
+            a = o["stages"].get(st, {}).get("total_s", 0.0)
+            b = n["stages"].get(st, {}).get("total_s", 0.0)
+            print(f"    {st:<22} {a:>8.2f} -> {b:>8.2f}  {delta(a, b)}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--lengths", type=int, nargs="+", default=list(LENGTHS), help="voces sintéticas (s)")
+    ap.add_argument("--modes", nargs="+", default=["cold", "warm"], choices=("cold", "warm"))
+    ap.add_argument("--compositor", choices=("moviepy", "ffmpeg"), default="moviepy")
+    ap.add_argument("--single-pass", action="store_true")
+    ap.add_argument("--fake-embeddings", action="store_true",
+                    help="embeddings por hash en vez de MiniLM (sin modelo descargado)")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="latencia agregada por request de API")
+    ap.add_argument("--hf-delay", nargs="+", default=[], metavar="MODELO=S",
+                    help="demora extra del stand-in de HF por modelo (p.ej. un SDXL lento)")
+    ap.add_argument("--hf-warmup", nargs="+", default=[], metavar="MODELO=N",
+                    help="cuántos 503 warming-up devuelve cada modelo antes de responder")
+    ap.add_argument("--library", type=int, default=0, metavar="N",
+                    help="biblioteca propia de N clips indexada antes de cada render")
+    ap.add_argument("--out", default=str(BENCH_DIR / "results.json"))
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    ap.add_argument("--verbose", action="store_true", help="mostrar la salida de cada render")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        child(json.loads(args.child))
+        return 0
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    fx, voices = make_fixtures(args.lengths)
+    if args.library:
+        make_library(fx, args.library)
+    server = StandIn(fx / "media", latency_s=args.latency_ms / 1000,
+                     hf_delay={m: float(v) for m, v in (x.rsplit("=", 1) for x in args.hf_delay)},
+                     hf_warmup={m: int(v) for m, v in (x.rsplit("=", 1) for x in args.hf_warmup)})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[bench] stand-ins en {server.base}")
+
+    runs = []
+    t0 = time.perf_counter()
+    for voice in voices:
+        cache_dir = BENCH_DIR / "cache" / voice["name"]
+        shutil.rmtree(cache_dir, ignore_errors=True)  # "cold" = cache vacío
+        for mode in args.modes:
+            res = run_one(server, voice, mode, cache_dir, args)
+            runs.append(res)
+            if res["ok"]:
+                print(f"[bench] {voice['name']:<10} {mode:<5} {res['wall_s']:>7.2f}s  "
+                      f"RSS {res.get('peak_rss_mb', '?')} MB  red {res['network']['bytes'] / 1e6:.1f} MB")
+            else:
+                print(f"[bench] {voice['name']:<10} {mode:<5} FALLÓ\n{res['error']}")
+    server.shutdown()
+
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = None
+    report = {"meta": {"git": rev, "python": platform.python_version(),
+                       "platform": platform.platform(), "cpus": os.cpu_count(),
+                       "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "total_s": round(time.perf_counter() - t0, 2),
+                       "options": {k: v for k, v in vars(args).items()
+                                   if k not in ("child", "compare", "out", "verbose")}},
+              "runs": runs}
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.out).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"[bench] resultados: {args.out}")
+    return 0 if all(r["ok"] for r in runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Chequeo de tiempo de arranque: importar build_short y correr `--help` no
+debe cargar modelos ni librerías pesadas.
+
+    python bench/import_time.py            # falla (exit 1) si se pasa del presupuesto
+    python bench/import_time.py --budget-ms 500
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# módulos que NO pueden aparecer en sys.modules después de `import build_short`
+HEAVY = ("torch", "sentence_transformers", "faster_whisper", "ctranslate2",
+         "moviepy", "numpy", "requests")
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import build_short
+dt = time.perf_counter() - t0
+print(json.dumps({"import_s": dt, "heavy": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def measure(repeats=3):
+    best = None
+    for _ in range(repeats):
+        r = subprocess.run([sys.executable, "-c", PROBE % (HEAVY,)], cwd=ROOT,
+                           capture_output=True, text=True, check=True)
+        res = json.loads(r.stdout.strip().splitlines()[-1])
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "build_short.py", "--help"], cwd=ROOT,
+                       capture_output=True, check=True)
+        res["help_s"] = time.perf_counter() - t0
+        if best is None or res["import_s"] < best["import_s"]:
+            best = res
+    return best
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--budget-ms", type=float, default=300.0, help="máximo para `import build_short`")
+    ap.add_argument("--help-budget-ms", type=float, default=1000.0, help="máximo para `build_short.py --help`")
+    args = ap.parse_args(argv)
+
+    res = measure()
+    print(json.dumps(res, indent=2))
+    errors = []
+    if res["heavy"]:
+        errors.append(f"imports pesados al arrancar: {', '.join(res['heavy'])}")
+    if res["import_s"] * 1000 > args.budget_ms:
+        errors.append(f"import build_short {res['import_s'] * 1000:.0f} ms > {args.budget_ms:.0f} ms")
+    if res["help_s"] * 1000 > args.help_budget_ms:
+        errors.append(f"--help {res['help_s'] * 1000:.0f} ms > {args.help_budget_ms:.0f} ms")
+    for e in errors:
+        print("[import-time] FALLA:", e)
+    if not errors:
+        print("[import-time] ok")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,13 @@
-import os, io, re, time, math, json, random, urllib.request, subprocess
+import os, io, re, time, math, json, random, urllib.request, subprocess, argparse
 from pathlib import Path
-import requests
-import textwrap  # <-- NUEVO
-from faster_whisper import WhisperModel
-from src.video import build_video_from_segments
-from src.music import pick_and_download_openverse, mix_music_into_video
+from src.transcribe import transcribe, transcribe_stream
+from src.video import build_video_from_segments, resolve_scene_assets
+from src.music import MUSIC_QUERIES, pick_music, mix_music_into_video
+from src.render import render_single_pass, subtitles_filter, ff_threads
+from src.tracing import span
+from src.subtitles import Cues
+from src.stages import Stage, run_stages
+from src.cache import file_sha256
 import unicodedata
 import re
 
@@ -14,6 +17,7 @@ FONT_SIZE = 18
 MARGIN_V = 120
 OUTLINE = 1
 SHADOW = 1
+SUB_STYLE = {"Fontsize": FONT_SIZE, "Outline": OUTLINE, "Shadow": SHADOW, "MarginV": MARGIN_V}
 
 
 def run(cmd):
@@ -24,28 +28,22 @@ def run(cmd):
 def file_exists(p): return Path(p).exists()
 
 
-def ensure_words_srt(audio, path="voz_words.srt"):
+def ensure_words_srt(audio, path="voz_words.srt", transcript=None):
     # Fuerza subtítulos palabra-a-palabra con tiempos reales
     # (usa GPU si tenés: device="cuda", compute_type="float16")
-    return srt_words_faster_whisper(
-        audio_path=audio,
-        out_srt=path,
-        model_size="medium",
-        language="es",
-        device="cpu",
-        compute_type="int8"
-    )
-
-
-def ensure_srt(audio="voz.mp3", srt="voz.srt"):
-    if file_exists(srt):
-        print(f"[ok] usando SRT existente: {srt}")
-        return srt
-    print("[i] generando SRT con Whisper (offline)…")
-    run(f'whisper "{audio}" --task transcribe --language {LANG} --model {WHISPER_MODEL} --output_format srt --output_dir .')
-    if not file_exists(srt):
-        raise RuntimeError("No se generó voz.srt")
-    return srt
+    if transcript is None:
+        transcript = transcribe(audio, model_size=WHISPER_MODEL, language=LANG,
+                                device="cpu", compute_type="int8")
+    return srt_words_from_transcript(transcript, path)
+
+
+def ensure_srt(audio="voz.mp3", srt="voz.srt", transcript=None):
+    # siempre se reescribe desde la transcripción (cacheada por hash del audio),
+    # así un voz.srt viejo nunca se usa con un audio nuevo
+    if transcript is None:
+        transcript = transcribe(audio, model_size=WHISPER_MODEL, language=LANG,
+                                device="cpu", compute_type="int8")
+    return write_srt(transcript, srt)
 
 
 def merge_short_segments(segs, min_scene=2.0, max_scene=5.0):
@@ -54,222 +52,95 @@ def merge_short_segments(segs, min_scene=2.0, max_scene=5.0):
     - Si la escena actual aún no llega a min_scene y al sumar el siguiente
       no supera max_scene, los fusiona.
     """
-    if not segs:
-        return []
-    out = []
-    cur = {"start": segs[0]["start"], "end": segs[0]["end"], "text": segs[0]["text"]}
-    for s in segs[1:]:
+    return list(iter_merge_segments(segs, min_scene, max_scene))
+
+
+def iter_merge_segments(segs, min_scene=2.0, max_scene=5.0):
+    """
+    merge_short_segments sobre un iterador: cada escena sale apenas llega el
+    segmento que ya no se le suma (sirve con la transcripción en streaming).
+    """
+    cur = None
+    for s in segs:
+        if cur is None:
+            cur = {"start": s["start"], "end": s["end"], "text": s["text"]}
+            continue
         cur_dur = cur["end"] - cur["start"]
         next_dur = s["end"] - cur["start"]
         if (cur_dur < min_scene) and (next_dur <= max_scene):
             cur["end"] = s["end"]
             cur["text"] = (cur["text"] + " " + s["text"]).strip()
         else:
-            out.append(cur)
+            yield cur
             cur = {"start": s["start"], "end": s["end"], "text": s["text"]}
-    out.append(cur)
-    return out
+    if cur is not None:
+        yield cur
 
 
-def parse_srt(srt_path):
-    # retorna lista de dicts: [{start, end, text}]
-    pat_time = re.compile(r"(\d+):(\d+):(\d+),(\d+)\s*-->\s*(\d+):(\d+):(\d+),(\+?\d+)")
-    segs, buf, t0, t1 = [], [], 0.0, 0.0
-    with open(srt_path, "r", encoding="utf-8", errors="ignore") as f:
-        block = []
-        for line in f:
-            if line.strip() == "" and block:
-                # parse block
-                # expected: idx, time, text...
-                if len(block) >= 2:
-                    m = pat_time.search(block[1])
-                    if m:
-                        hh, mm, ss, ms = map(int, m.groups()[:4])
-                        HH, MM, SS, MS = map(int, m.groups()[4:])
-                        t0 = hh * 3600 + mm * 60 + ss + ms / 1000
-                        t1 = HH * 3600 + MM * 60 + SS + MS / 1000
-                        text = " ".join(x.strip() for x in block[2:] if x.strip())
-                        segs.append({"start": t0, "end": t1, "text": text})
-                block = []
-            else:
-                block.append(line.rstrip("\n"))
-        # último bloque
-        if block and len(block) >= 2:
-            m = pat_time.search(block[1])
-            if m:
-                hh, mm, ss, ms = map(int, m.groups()[:4])
-                HH, MM, SS, MS = map(int, m.groups()[4:])
-                t0 = hh * 3600 + mm * 60 + ss + ms / 1000
-                t1 = HH * 3600 + MM * 60 + SS + MS / 1000
-                text = " ".join(x.strip() for x in block[2:] if x.strip())
-                segs.append({"start": t0, "end": t1, "text": text})
-    return segs
-
-
-def _ts(t):
-    # t en segundos -> "HH:MM:SS,mmm"
-    ms = int(round((t - int(t)) * 1000))
-    t = int(t)
-    s = t % 60
-    m = (t // 60) % 60
-    h = t // 3600
-    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+def _stream_transcript(audio, transcript):
+    # segmentos de Whisper a medida que salen; quedan también en `transcript`
+    with span("transcribe"):
+        for seg in transcribe_stream(audio, model_size=WHISPER_MODEL, language=LANG,
+                                     device="cpu", compute_type="int8"):
+            transcript.append(seg)
+            yield seg
 
 
-def srt_words_from_segments(segs, out_srt, words_per_chunk=1, min_dur=0.12):
-    """
-    Convierte segmentos (start,end,text) en un SRT a nivel palabra.
-    - words_per_chunk: cuántas palabras por cue (1 = una palabra)
-    - min_dur: duración mínima por cue (seg); si no se llega, agrupa más palabras.
-    """
-    idx = 1
-    lines = []
-    for s in segs:
-        t0, t1 = s["start"], s["end"]
-        dur = max(0.01, t1 - t0)
-        # tokenización simple (palabras con tildes) y conserva signos sueltos como "extras"
-        raw = s["text"].strip()
-        if not raw:
-            continue
-        # separa por espacios y quita comas/puntos del extremo
-        tokens = []
-        for tok in raw.split():
-            tok_clean = tok.strip(".,;:!?¡¿()[]«»\"'")
-            if tok_clean:
-                tokens.append(tok_clean)
-
-        if not tokens:
-            continue
+def _stream_scenes(audio, transcript, min_scene=2.0, max_scene=5.0):
+    # escenas a medida que se cierran; el span scene_merge abarca el streaming
+    # (igual que transcribe, que corre adentro) y anota segmentos -> escenas
+    with span("scene_merge") as sp:
+        sp["scenes"] = 0
+        for scene in iter_merge_segments(_stream_transcript(audio, transcript), min_scene, max_scene):
+            sp["scenes"] += 1
+            yield scene
+        sp["segments"] = len(transcript)
 
-        # duración base por palabra
-        base_dt = dur / len(tokens)
 
-        # si base_dt < min_dur, agrupar automáticamente
-        auto_group = max(1, math.ceil(min_dur / max(base_dt, 1e-6)))
-        group = max(1, words_per_chunk, auto_group)
+def parse_srt(srt_path):
+    # retorna lista de dicts: [{start, end, text}]
+    return Cues.from_srt(srt_path).segments()
 
-        # número de cues
-        n_cues = math.ceil(len(tokens) / group)
-        cue_dt = dur / n_cues
 
-        for k in range(n_cues):
-            start = t0 + k * cue_dt
-            end = min(t1, start + cue_dt)
-            chunk = tokens[k * group: (k + 1) * group]
-            if not chunk:
-                continue
-            text = " ".join(chunk)
+def srt_words_from_segments(segs, out_srt, words_per_chunk=1, min_dur=0.12):
+    """Convierte segmentos (start,end,text) en un SRT a nivel palabra (ver Cues.split_words)."""
+    return Cues.split_words(segs, words_per_chunk, min_dur).to_srt(out_srt)
 
-            lines.append(str(idx))
-            lines.append(f"{_ts(start)} --> {_ts(end)}")
-            lines.append(text)
-            lines.append("")  # separador
-            idx += 1
 
-    with open(out_srt, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
-    return out_srt
+def wrap_srt(in_srt, out_srt, max_chars=30):
+    return Cues.from_srt(in_srt).wrapped(max_chars).to_srt(out_srt)
 
 
-def wrap_srt(in_srt, out_srt, max_chars=30):
-    with open(in_srt, "r", encoding="utf-8", errors="ignore") as f:
-        blocks, block = [], []
-        for line in f:
-            if line.strip() == "":
-                if block: blocks.append(block); block = []
-            else:
-                block.append(line.rstrip("\n"))
-        if block: blocks.append(block)
-
-    pat_time = re.compile(r"\d+:\d+:\d+,\d+\s*-->\s*\d+:\d+:\d+,\d+")
-    out = []
-    for b in blocks:
-        if len(b) >= 3 and pat_time.search(b[1]):
-            idx = b[0]
-            time = b[1]
-            text = " ".join(x for x in b[2:] if x.strip())
-            wrapped = textwrap.fill(text, width=max_chars)  # inserta saltos
-            # limitar a 2 líneas (para shorts es lo ideal)
-            lines = wrapped.splitlines()
-            if len(lines) > 2:
-                # junta el resto en la 2ª
-                wrapped = "\n".join([lines[0], " ".join(lines[1:])])
-            out += [idx, time, wrapped, ""]
-        else:
-            out += b + [""]
+def write_srt(segs, out_srt):
+    """Escribe segmentos [{start, end, text}] como SRT (un cue por segmento)."""
+    return Cues.from_segments(segs).to_srt(out_srt)
 
-    with open(out_srt, "w", encoding="utf-8") as f:
-        f.write("\n".join(out))
 
-    return out_srt
+def srt_words_from_transcript(segs, out_srt, min_dur=0.12):
+    """SRT palabra-a-palabra desde la salida de transcribe() (ver Cues.from_words)."""
+    return Cues.from_words(segs, min_dur).to_srt(out_srt)
 
 
 def srt_words_faster_whisper(audio_path, out_srt, model_size="medium", language="es",
                              device="cpu", compute_type="int8"):  # usa "cuda" si tienes GPU
-    model = WhisperModel(model_size, device=device, compute_type=compute_type)
-
-    segments, info = model.transcribe(
-        audio_path,
-        language=language,
-        vad_filter=True,
-        word_timestamps=True,
-    )
-
-    def _ts(t):
-        ms = int(round((t - int(t)) * 1000))
-        t = int(t);
-        s = t % 60;
-        m = (t // 60) % 60;
-        h = t // 3600
-        return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
-
-    idx = 1
-    lines = []
-    MIN_DUR = 0.12  # asegura que no “parpadee”
-    for seg in segments:
-        words = getattr(seg, "words", None) or []
-        if not words:
-            # fallback: un cue por segmento
-            lines += [str(idx), f"{_ts(seg.start)} --> {_ts(seg.end)}", seg.text.strip(), ""]
-            idx += 1
-            continue
-        # fusiona palabras demasiado cortas
-        buf = []
-        for w in words:
-            buf.append(w)
-            # si el último bloque es muy corto, espera sumar otra palabra
-            dur = (buf[-1].end - buf[0].start)
-            if dur >= MIN_DUR:
-                text = " ".join(x.word for x in buf).strip()
-                lines += [str(idx), f"{_ts(buf[0].start)} --> {_ts(buf[-1].end)}", text, ""]
-                idx += 1
-                buf = []
-        if buf:
-            text = " ".join(x.word for x in buf).strip()
-            lines += [str(idx), f"{_ts(buf[0].start)} --> {_ts(buf[-1].end)}", text, ""]
-            idx += 1
-
-    with open(out_srt, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
-    return out_srt
-
-
-def burn_subs(input_mp4="tmp_with_music.mp4", srt="voz_words.srt", out="short_final.mp4"):
-    out = str(Path(out).with_suffix(".mp4"))
+    transcript = transcribe(audio_path, model_size=model_size, language=language,
+                            device=device, compute_type=compute_type)
+    return srt_words_from_transcript(transcript, out_srt)
 
-    # estilo ASS
-    style = f"Fontsize={FONT_SIZE},Outline={OUTLINE},Shadow={SHADOW},MarginV={MARGIN_V}"
 
-    # Ruta absoluta en formato POSIX y ESCAPE de caracteres problemáticos para FFmpeg filtergraph
-    srt_posix = Path(srt).resolve().as_posix()
-    # En filtros de FFmpeg, ':' separa opciones, así que hay que escaparlo como '\:'
-    # También escapamos comillas simples por seguridad.
-    srt_escaped = srt_posix.replace(":", r"\:").replace("'", r"\'")
+def burn_subs(input_mp4="tmp_with_music.mp4", srt="voz_words.ass", out="short_final.mp4"):
+    out = str(Path(out).with_suffix(".mp4"))
+
+    # un .ass (Cues.to_ass) ya trae el estilo; a un SRT se le fuerza el estilo ASS
+    style = None
+    if Path(srt).suffix.lower() != ".ass":
+        style = f"Fontsize={FONT_SIZE},Outline={OUTLINE},Shadow={SHADOW},MarginV={MARGIN_V}"
 
-    # Importante: poner el filename entre comillas simples dentro del filtro
-    vf = f"subtitles='{srt_escaped}':force_style='{style}'"
+    # Ruta absoluta escapada y entre comillas simples dentro del filtro
+    vf = subtitles_filter(srt, style)
 
-    cmd = f'''ffmpeg -y -i "{input_mp4}" -vf "{vf}" -c:a copy "{out}"'''
+    threads = f"-threads {ff_threads()} " if ff_threads() else ""
+    cmd = f'''ffmpeg -y -i "{input_mp4}" -vf "{vf}" -c:a copy {threads}"{out}"'''
     run(cmd)
     return out
 
@@ -299,35 +170,197 @@ def burn_subs_with_music(
 
 
 
-if __name__ == "__main__":
-    audio = "voz.mp3"
-    from datetime import datetime
+def warm_models(workers=1):
+    # deja Whisper y MiniLM cargados antes del primer trabajo (daemon)
+    from src.transcribe import get_whisper_model
+    from src.embeddings import get_emb_model
+    get_whisper_model(WHISPER_MODEL, "cpu", "int8", num_workers=workers)
+    get_emb_model()
 
-    ts = time.strftime("%Y-%m-%d%H%M%S")
-    fn_name = f"short-{ts}.mp4"
-    # 1) SRT base para escenas (b-roll contextual por frase)
-    srt_original = ensure_srt(audio, "voz.srt")
-    segs_raw = parse_srt(srt_original)
-    scene_segs = merge_short_segments(segs_raw, min_scene=2.0, max_scene=5.0)
-    print(f"[i] escenas b-roll: {len(scene_segs)}")
 
-    # 2) Generar SRT palabra-a-palabra real
-    srt_words = ensure_words_srt(audio, "voz_words.srt")
-
-    # 3) Construir video por escenas (b-roll coherente por frase)
-    base = build_video_from_segments(scene_segs, audio)
+def render_short(audio="voz.mp3", out=None, work_dir=".", single_pass=False, compositor="moviepy",
+                 trace=False, max_work_bytes=None):
+    """
+    Pipeline completo de un short. Todos los intermedios (subtítulos, tmp_base.mp4,
+    música, b-roll) van a `work_dir`; devuelve la ruta del mp4 final.
+    - trace: mide cada etapa y escribe <out>.trace.json (Chrome/Perfetto) + resumen
+    - max_work_bytes: tope de `work_dir`; se mide entre etapas y el render
+      falla si lo pasa (el batch lo usa para acotar cada workspace)
+    """
+    out = out or f"short-{time.strftime('%Y-%m-%d%H%M%S')}.mp4"
+    if not trace:
+        return _render_short(audio, out, Path(work_dir), single_pass, compositor, max_work_bytes)
+    from src.tracing import tracing
+    with tracing(str(Path(out).with_suffix(".trace.json")), name=Path(out).name):
+        with span("render", audio=str(audio), single_pass=single_pass, compositor=compositor):
+            return _render_short(audio, out, Path(work_dir), single_pass, compositor, max_work_bytes)
 
-    # 2) elegir SRT (por palabra o envuelto a 2 líneas)
-    # srt_path = "voz_words.srt"
-    srt_path = wrap_srt("voz.srt", "voz_wrapped.srt", max_chars=30)
 
-    # 3) bajar música synthwave ALEATORIA
-    music_path, meta = pick_and_download_openverse(out="music.mp3")
-    print("[music]", meta)
+def _render_short(audio, out, wd, single_pass, compositor, max_work_bytes=None):
+    """
+    Etapas como grafo (src/stages.py): lo independiente corre en paralelo
+    (la música no depende de la voz ni del video) y, si el render se cae,
+    el próximo con el mismo work_dir retoma desde la última etapa terminada.
+    """
+    wd.mkdir(parents=True, exist_ok=True)
+    audio_sha = file_sha256(audio)
+
+    def scenes():
+        # 1) una sola transcripción (segmentos + palabras) para escenas y subtítulos,
+        #    en streaming: cada escena pasa a keywords + búsqueda/descarga de b-roll
+        #    apenas sus segmentos están cerrados, mientras Whisper sigue con el resto
+        #    (la imagen IA de la primera escena arranca con la primera frase)
+        transcript = []
+        segs = _stream_scenes(audio, transcript, min_scene=2.0, max_scene=5.0)
+        assets = resolve_scene_assets(segs, tmp_dir=wd / "tmp_broll")
+        print(f"[i] escenas b-roll: {len(assets)}")
+        return {"transcript": transcript, "assets": assets}
+
+    def subs(sc):
+        # 2) subtítulos palabra-a-palabra reales (mismos tiempos de palabra, sin 2º modelo):
+        #    en memoria y escritos una sola vez, ya con estilo, como .ass para el burn
+        #    (para subtítulos por frase a 2 líneas: Cues.from_segments(transcript).wrapped(30))
+        return Cues.from_words(sc["transcript"]).to_ass(str(wd / "voz_words.ass"), **SUB_STYLE)
+
+    def music():
+        # 3) música synthwave ALEATORIA (catálogo local; Openverse sólo si no hay)
+        music_path, meta = pick_music(out=str(wd / "music.mp3"), q_list=MUSIC_QUERIES)
+        print("[music]", meta)
+        return {"path": music_path, "meta": meta}
+
+    stages = [
+        Stage("scenes", scenes, params={"audio": audio_sha, "model": WHISPER_MODEL,
+                                        "lang": LANG}),
+        # la voz entra en la clave: un estado viejo de otro audio no se reusa
+        Stage("music", music, params={"audio": audio_sha, "queries": list(MUSIC_QUERIES)}),
+    ]
+    if single_pass:
+        # escenas + música + subtítulos en una sola codificación
+        stages += [
+            Stage("subs", subs, deps=["scenes"], params=SUB_STYLE),
+            Stage("encode", lambda sc, m, sub: render_single_pass(sc["assets"], audio, m["path"], sub, out),
+                  deps=["scenes", "music", "subs"], params={"out": out}),
+        ]
+    elif compositor == "ffmpeg":
+        # subtítulos quemados escena por escena (van en la clave de cada segmento):
+        # corregir una frase recodifica sólo sus escenas; el resto del camino es copia
+        final = str(Path(out).with_suffix(".mp4"))
+        stages += [
+            Stage("base", lambda sc: build_video_from_segments(
+                None, audio, out=str(wd / "tmp_base.mp4"), tmp_dir=wd / "tmp_broll",
+                compositor=compositor, assets=sc["assets"],
+                cues=Cues.from_words(sc["transcript"]), sub_style=SUB_STYLE),
+                deps=["scenes"], params={"compositor": compositor, "subs": SUB_STYLE}),
+            Stage("music_mix", lambda base, m: mix_music_into_video(base, m["path"], out=final),
+                  deps=["base", "music"], params={"out": final}),
+        ]
+    else:
+        stages += [
+            Stage("subs", subs, deps=["scenes"], params=SUB_STYLE),
+            # video por escenas (b-roll coherente por frase)
+            Stage("base", lambda sc: build_video_from_segments(
+                None, audio, out=str(wd / "tmp_base.mp4"), tmp_dir=wd / "tmp_broll",
+                compositor=compositor, assets=sc["assets"]),
+                deps=["scenes"], params={"compositor": compositor}),
+            Stage("music_mix", lambda base, m: mix_music_into_video(
+                base, m["path"], out=str(wd / "tmp_with_music.mp4")),
+                deps=["base", "music"]),
+            # subtítulos quemados sobre el video con música
+            Stage("subs_burn", lambda mixed, sub: burn_subs(mixed, sub, out),
+                  deps=["music_mix", "subs"], params={"out": out}),
+        ]
+    after = None
+    if max_work_bytes:
+        from src.batch import check_workspace
+        after = check_workspace(wd, max_work_bytes)
+    results, _ = run_stages(stages, state_dir=wd / ".stages", after_stage=after)
+    return results[stages[-1].name]
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Genera un short vertical a partir de voz.mp3")
+    ap.add_argument("audio", nargs="?", default="voz.mp3", help="voz en off (default: voz.mp3)")
+    ap.add_argument("--single-pass", action="store_true",
+                    help="render final en una sola codificación ffmpeg (escenas+música+subtítulos)")
+    ap.add_argument("--compositor", choices=("moviepy", "ffmpeg"), default="moviepy",
+                    help="armado del video base: moviepy (original) o ffmpeg por escena + concat "
+                         "(reusa las escenas sin cambios de renders anteriores)")
+    ap.add_argument("--trace", action="store_true",
+                    help="tiempos por etapa/escena en <out>.trace.json (chrome://tracing) + resumen")
+    ap.add_argument("--out", help="mp4 final (default: short-<fecha>.mp4)")
+    music = ap.add_argument_group("música (catálogo local en .cache/music)")
+    music.add_argument("--refresh-music", nargs="*", metavar="QUERY",
+                       help="llenar el catálogo desde Openverse (default: queries de siempre) y salir")
+    music.add_argument("--music-report", action="store_true", help="resumen del catálogo y salir")
+    library = ap.add_argument_group("biblioteca de b-roll propia (índice en .cache/library)")
+    library.add_argument("--index-library", nargs="?", const="", metavar="DIR",
+                         help="indexar los clips de DIR (default: BROLL_LIBRARY o assets/) y salir")
+    library.add_argument("--library-report", action="store_true", help="resumen del índice y salir")
+    daemon = ap.add_argument_group("daemon (modelos en memoria + cola de trabajos en un spool)")
+    daemon.add_argument("--daemon", metavar="SPOOL", help="atender trabajos del directorio SPOOL")
+    daemon.add_argument("--workers", type=int, default=1, help="renders simultáneos del daemon")
+    daemon.add_argument("--submit", metavar="SPOOL", help="encolar `audio` en SPOOL y salir")
+    daemon.add_argument("--status", metavar="SPOOL", help="mostrar el estado de los trabajos de SPOOL")
+    daemon.add_argument("--requeue", nargs=2, metavar=("SPOOL", "ID"),
+                        help="volver a encolar un trabajo fallido (mismo id: retoma su workspace)")
+    batch = ap.add_argument_group("batch (muchas voces en paralelo, un workspace por trabajo)")
+    batch.add_argument("--batch", metavar="SRC", help="directorio de audios o manifest (.json/.txt)")
+    batch.add_argument("--out-dir", default="shorts", help="carpeta de los mp4 del batch")
+    batch.add_argument("--jobs", type=int, help="procesos en paralelo (default: CPUs/4)")
+    batch.add_argument("--threads", type=int, help="hilos de CPU por proceso (default: CPUs/jobs)")
+    batch.add_argument("--work-root", default="batch_work", help="workspaces temporales")
+    batch.add_argument("--keep-work", action="store_true", help="no borrar los workspaces al terminar")
+    return ap.parse_args(argv)
 
-    # si ya tenés tmp_base.mp4 (con tu voz):
-    with_music = mix_music_into_video("tmp_base.mp4", music_path, out="tmp_with_music.mp4")
 
-    # luego quemás subtítulos sobre ese archivo:
-    final = burn_subs(with_music, srt_words, fn_name)
-    print(f"[✔] Listo: {final}")
+if __name__ == "__main__":
+    args = parse_args()
+    if args.refresh_music is not None:
+        from src.music import MUSIC_QUERIES
+        from src.music_catalog import refresh_catalog, catalog_report
+        n = refresh_catalog(args.refresh_music or MUSIC_QUERIES)
+        print(f"[music] {n} temas nuevos")
+        catalog_report()
+    elif args.music_report:
+        from src.music_catalog import catalog_report
+        catalog_report()
+    elif args.index_library is not None:
+        from src.library import build_index, library_report
+        build_index(args.index_library or None)
+        library_report()
+    elif args.library_report:
+        from src.library import library_report
+        library_report()
+    elif args.daemon:
+        from src.daemon import serve
+        serve(args.daemon, render_short, workers=args.workers,
+              warm=lambda: warm_models(args.workers))
+    elif args.submit:
+        from src.daemon import submit_job
+        job_id = submit_job(args.submit, args.audio, out=args.out,
+                            options={"single_pass": args.single_pass,
+                                     "compositor": args.compositor, "trace": args.trace})
+        print(f"[daemon] encolado {job_id}")
+    elif args.batch:
+        from src.batch import collect_jobs, run_batch, WORK_MAX_BYTES
+        jobs = collect_jobs(args.batch, out_dir=args.out_dir)
+        for j in jobs:
+            j["options"].setdefault("max_work_bytes", WORK_MAX_BYTES)
+            j["options"].setdefault("single_pass", args.single_pass)
+            j["options"].setdefault("compositor", args.compositor)
+            j["options"].setdefault("trace", args.trace)
+        results = run_batch(jobs, render_short, workers=args.jobs, threads=args.threads,
+                            work_root=args.work_root, keep_work=args.keep_work,
+                            report=str(Path(args.out_dir) / "batch_report.json"))
+        raise SystemExit(0 if all(r["state"] == "done" for r in results) else 1)
+    elif args.requeue:
+        from src.daemon import requeue_job
+        requeue_job(*args.requeue)
+        print(f"[daemon] reencolado {args.requeue[1]}")
+    elif args.status:
+        from src.daemon import print_status
+        print_status(args.status)
+    else:
+        final = render_short(args.audio, args.out, ".", single_pass=args.single_pass,
+                             compositor=args.compositor, trace=args.trace)
+        print(f"[✔] Listo: {final}")
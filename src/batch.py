@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import shutil
+import traceback
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.env import env
+from src.cache import write_atomic
+
+AUDIO_EXTS = (".mp3", ".wav", ".m4a", ".ogg", ".flac")
+WORK_MAX_BYTES = int(env("BATCH_WORK_MAX_BYTES", str(2 << 30)))  # tope del workspace de cada job (0 = sin tope)
+MIN_FREE_BYTES = int(env("BATCH_MIN_FREE_BYTES", str(2 << 30)))  # chequeo previo: disco libre para arrancar un job
+
+
+def collect_jobs(source, out_dir="shorts"):
+    """
+    Lista de trabajos [{name, audio, out, options}] desde:
+    - un directorio: todos los audios (AUDIO_EXTS), uno por short
+    - un manifest .json: ["a.mp3", {"audio": "b.mp3", "out": "...", "options": {...}}]
+    - un manifest de texto: una ruta de audio por línea (# comenta)
+    Las rutas relativas del manifest son relativas al manifest.
+    """
+    source = Path(source)
+    if source.is_dir():
+        entries = [str(p) for p in sorted(source.iterdir()) if p.suffix.lower() in AUDIO_EXTS]
+        base = source
+    elif source.suffix.lower() == ".json":
+        entries = json.loads(source.read_text(encoding="utf-8"))
+        base = source.parent
+    else:
+        lines = source.read_text(encoding="utf-8").splitlines()
+        entries = [l.strip() for l in lines if l.strip() and not l.strip().startswith("#")]
+        base = source.parent
+
+    jobs, names = [], set()
+    for e in entries:
+        e = {"audio": e} if isinstance(e, str) else dict(e)
+        audio = Path(e["audio"])
+        audio = audio if audio.is_absolute() else base / audio
+        # mismo nombre de audio en dos carpetas: no pisar la salida
+        name, k = audio.stem, 1
+        while name in names:
+            k += 1
+            name = f"{audio.stem}-{k}"
+        names.add(name)
+        out = Path(e.get("out") or Path(out_dir) / f"{name}.mp4")
+        jobs.append({"name": name, "audio": str(audio.resolve()), "out": str(out.resolve()),
+                     "options": e.get("options") or {}})
+    return jobs
+
+
+def workspace_bytes(path):
+    """Bytes que ocupan los archivos bajo `path` (0 si no existe)."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass  # se borró mientras se recorría
+    return total
+
+
+def check_workspace(work, max_bytes):
+    """
+    after_stage para run_stages: entre etapa y etapa mide el workspace del
+    job (intermedios + tmp_broll) y lo corta si pasó `max_bytes`.
+    """
+    def check(stage):
+        used = workspace_bytes(work)
+        if used > max_bytes:
+            raise RuntimeError(f"workspace {work} ocupa {used / 1e9:.2f} GB después de "
+                               f"'{stage}' (tope {max_bytes / 1e9:.2f} GB)")
+    return check
+
+
+def _limit_worker(threads, cpus, slots):
+    # corre en cada proceso del pool antes del primer trabajo
+    slot = slots.get()  # 0..workers-1: qué tajada de CPUs le toca a este proceso
+    if threads:
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                    "FFMPEG_THREADS"):
+            os.environ[var] = str(threads)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        # cada worker (y los ffmpeg que lanza) queda en su tajada de CPUs
+        n = min(threads or 1, len(cpus))
+        start = (slot * n) % len(cpus)
+        os.sched_setaffinity(0, {cpus[(start + i) % len(cpus)] for i in range(n)})
+
+
+def _run_one(render, job, work_root, keep_work, min_free):
+    work = Path(work_root) / job["name"]
+    t0 = time.time()
+    res = {"name": job["name"], "audio": job["audio"], "pid": os.getpid()}
+    try:
+        # sólo al arrancar; el tope durante el render es max_work_bytes (check_workspace)
+        free = shutil.disk_usage(Path(work_root)).free
+        if free < min_free:
+            raise RuntimeError(f"poco disco libre en {work_root}: {free / 1e9:.1f} GB")
+        Path(job["out"]).parent.mkdir(parents=True, exist_ok=True)
+        res["result"] = render(job["audio"], job["out"], str(work), **job["options"])
+        # la atribución de la música se guarda junto al short
+        music_meta = work / "music.json"
+        if music_meta.exists():
+            shutil.copyfile(music_meta, Path(job["out"]).with_suffix(".music.json"))
+        res["state"] = "done"
+    except Exception as e:
+        res.update(state="failed", error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+    res["elapsed_s"] = round(time.time() - t0, 2)
+    if not keep_work and res["state"] == "done":
+        shutil.rmtree(work, ignore_errors=True)  # lo fallido queda para revisar
+    return res
+
+
+def run_batch(jobs, render, workers=None, threads=None, work_root="batch_work",
+              keep_work=False, min_free=MIN_FREE_BYTES, report=None):
+    """
+    Renderiza `jobs` (collect_jobs) en un pool de procesos: cada trabajo en su
+    propio work_root/<name>, hasta `workers` a la vez, `threads` hilos de
+    CPU por worker (BLAS/Whisper/x264 + afinidad en Linux).
+    Devuelve [{name, state, result|error, elapsed_s}] en el orden de `jobs`.
+    """
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+    n_cpu = len(cpus) if cpus else (os.cpu_count() or 1)
+    workers = max(1, min(workers or max(1, n_cpu // 4), len(jobs) or 1))
+    threads = threads or max(1, n_cpu // workers)
+    Path(work_root).mkdir(parents=True, exist_ok=True)
+    print(f"[batch] {len(jobs)} trabajos, {workers} procesos x {threads} hilos")
+
+    t0 = time.time()
+    results = {}
+    slots = multiprocessing.Queue()
+    for i in range(workers):
+        slots.put(i)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_limit_worker,
+                             initargs=(threads, cpus, slots)) as pool:
+        futs = {pool.submit(_run_one, render, j, work_root, keep_work, min_free): j for j in jobs}
+        for fut in as_completed(futs):
+            job = futs[fut]
+            try:
+                res = fut.result()
+            except Exception as e:  # p.ej. el worker murió (OOM)
+                res = {"name": job["name"], "audio": job["audio"], "state": "failed",
+                       "error": f"{type(e).__name__}: {e}"}
+            results[job["name"]] = res
+            mark = "✔" if res["state"] == "done" else "✘"
+            print(f"[batch] {mark} {res['name']} ({res.get('elapsed_s', '?')}s) "
+                  f"{res.get('result') or res.get('error')}  [{len(results)}/{len(jobs)}]")
+
+    out = [results[j["name"]] for j in jobs]
+    ok = sum(r["state"] == "done" for r in out)
+    print(f"[batch] listo: {ok}/{len(out)} ok en {time.time() - t0:.1f}s")
+    if report:
+        write_atomic(report, json.dumps(out, ensure_ascii=False, indent=2))
+    try:
+        Path(work_root).rmdir()  # sólo si quedó vacío (todo salió bien)
+    except OSError:
+        pass
+    return out
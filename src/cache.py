@@ -0,0 +1,391 @@
+import os
+import json
+import time
+import hashlib
+import weakref
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from src.env import env
+from src.tracing import annotate
+
+# --- CONFIG ---
+CACHE_ROOT = Path(env("SHORTAUTO_CACHE", ".cache"))
+BROLL_DIR = CACHE_ROOT / "broll"
+BROLL_MAX_BYTES = int(env("BROLL_CACHE_MAX_BYTES", str(5 << 30)))  # 5 GB
+BROLL_PROTECT_S = 3600  # no evictar lo usado en la última hora (render en curso)
+BROLL_PART_MAX_AGE_S = 24 * 3600  # .part sin tocar hace un día: se borra
+SEGMENTS_DIR = CACHE_ROOT / "segments"
+SEGMENTS_MAX_BYTES = int(env("SEGMENT_CACHE_MAX_BYTES", str(2 << 30)))  # 2 GB
+SEARCH_DIR = CACHE_ROOT / "search"
+SEARCH_TTL_S = int(env("SEARCH_CACHE_TTL_S", str(7 * 24 * 3600)))  # 7 días
+IA_DIR = CACHE_ROOT / "ia"
+IA_MAX_BYTES = int(env("IA_CACHE_MAX_BYTES", str(512 << 20)))  # 512 MB
+IA_SUFFIXES = (".png", ".jpg", ".webp")
+
+BROLL_STATS = {"hit": 0, "miss": 0, "bytes_downloaded": 0, "evicted": 0}
+SEARCH_STATS = {"memo": 0, "disk": 0, "api": 0}
+SEGMENT_STATS = {"hit": 0, "miss": 0}
+IA_STATS = {"hit": 0, "miss": 0}
+
+_LOCK = threading.Lock()
+_KEY_LOCKS = weakref.WeakValueDictionary()  # clave -> Lock mientras alguien lo use
+# clave -> resultado (o excepción) dentro del render actual; por contexto y no
+# global: el daemon corre varios renders a la vez en hilos del mismo proceso
+_SEARCH_MEMO = ContextVar("search_memo", default=None)
+
+
+def _sha(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_sha256(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(chunk), b""):
+            h.update(b)
+    return h.hexdigest()
+
+
+def _key_lock(key):
+    # un lock por clave: dos hilos no descargan la misma URL a la vez
+    # (referencia débil: cuando nadie lo tiene se va, el dict no crece sin fin)
+    with _LOCK:
+        lock = _KEY_LOCKS.get(key)
+        if lock is None:
+            lock = _KEY_LOCKS[key] = threading.Lock()
+        return lock
+
+
+def _count(name, n=1, stats=BROLL_STATS):
+    with _LOCK:
+        stats[name] += n
+
+
+def write_atomic(path, data):
+    """Escribe bytes/str en un temporal del mismo dir y lo renombra (atómico)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with open(tmp, mode, **({} if mode == "wb" else {"encoding": "utf-8"})) as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return path
+
+
+@contextmanager
+def file_lock(path, timeout=30.0, stale_s=120.0, heartbeat_s=None):
+    # lock entre procesos con O_EXCL (anda igual en Windows y Linux)
+    # heartbeat_s: mientras se tiene, se toca el lock cada tanto, así una
+    # espera larga (una descarga) no lo hace pasar por huérfano
+    t0 = time.time()
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale_s:
+                    os.unlink(path)  # lock huérfano de un proceso muerto
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() - t0 > timeout:
+                raise TimeoutError(f"lock ocupado: {path}")
+            time.sleep(0.05)
+    stop = threading.Event()
+    beat = None
+    if heartbeat_s:
+        def touch():
+            while not stop.wait(heartbeat_s):
+                try:
+                    os.utime(fd if os.utime in os.supports_fd else path)
+                except OSError:
+                    return
+        beat = threading.Thread(target=touch, name="lock-heartbeat", daemon=True)
+        beat.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        if beat is not None:
+            beat.join()
+        os.close(fd)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _ref_path(key):
+    return BROLL_DIR / "urls" / f"{key}.json"
+
+
+def _lookup(key):
+    ref = _ref_path(key)
+    if not ref.exists():
+        return None
+    try:
+        meta = json.loads(ref.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    blob = BROLL_DIR / "blobs" / meta.get("file", "")
+    if not meta.get("file") or not blob.exists():
+        return None  # el blob fue evictado
+    return blob
+
+
+def cached_download(url, suffix, fetch, variant=None):
+    """
+    Devuelve la ruta local de `url` dentro del cache de b-roll.
+    - clave: URL (+ variant) -> sha256 del contenido (blobs deduplicados por contenido)
+    - `fetch(url, out)` se llama sólo si no está (p.ej. video.download)
+    - variant: descarga parcial (p.ej. "head=7.0s"); si la URL completa ya
+      está en cache se usa esa
+    - se descarga a tmp/<clave>.part (reanudable: si se corta, el próximo
+      intento sigue desde ahí) y se renombra al terminar
+    """
+    full_key = _sha(url)
+    key = _sha(f"{url}#{variant}") if variant else full_key
+    with _key_lock(key):
+        blob = _lookup(key) or (_lookup(full_key) if variant else None)
+        if blob is not None:
+            _count("hit")
+            annotate(cache="hit")
+            os.utime(blob)  # LRU por mtime
+            return str(blob)
+
+        _count("miss")
+        annotate(cache="miss")
+        tmp_dir = BROLL_DIR / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        part = tmp_dir / f"{key}.part"
+        # otro proceso bajando la misma URL: se espera y se usa su resultado
+        with file_lock(str(tmp_dir / f"{key}.lock"), timeout=600.0, stale_s=60.0, heartbeat_s=10.0):
+            blob = _lookup(key)
+            if blob is not None:
+                _count("hit")
+                annotate(cache="hit")
+                return str(blob)
+            fetch(url, str(part))
+            size = part.stat().st_size
+            digest = file_sha256(part)
+            blob = BROLL_DIR / "blobs" / f"{digest}{suffix}"
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            if blob.exists():
+                part.unlink()
+                os.utime(blob)
+            else:
+                os.replace(part, blob)
+            _count("bytes_downloaded", size)
+            write_atomic(_ref_path(key), json.dumps(
+                {"url": url, "variant": variant, "sha256": digest, "file": blob.name,
+                 "size": size, "added_at": int(time.time())}))
+
+    evict_broll()
+    return str(blob)
+
+
+def evict_broll(max_bytes=None):
+    """Borra los blobs menos usados (mtime) hasta quedar bajo el presupuesto."""
+    max_bytes = BROLL_MAX_BYTES if max_bytes is None else max_bytes
+    # .part abandonados (descargas cortadas que nunca se retomaron)
+    tmp_dir = BROLL_DIR / "tmp"
+    if tmp_dir.exists():
+        for p in tmp_dir.glob("*.part"):
+            try:
+                if time.time() - p.stat().st_mtime > BROLL_PART_MAX_AGE_S:
+                    p.unlink()
+            except FileNotFoundError:
+                continue
+    freed, n, total = _evict_lru(BROLL_DIR / "blobs", max_bytes)
+    if freed:
+        _count("evicted", n)
+        print(f"[cache] broll evictados {freed / 1e6:.1f} MB (quedan {total / 1e6:.1f} MB)")
+    return freed
+
+
+def _evict_lru(directory, max_bytes, protect_s=BROLL_PROTECT_S):
+    """
+    Borra los archivos de `directory` menos usados (mtime) hasta quedar bajo
+    max_bytes. Devuelve (bytes_liberados, n_archivos, bytes_restantes).
+    """
+    if not directory.exists():
+        return 0, 0, 0
+    entries = []
+    for p in directory.iterdir():
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    total = sum(e[1] for e in entries)
+    now = time.time()
+    freed, n = 0, 0
+    for mtime, size, p in sorted(entries):
+        if total <= max_bytes:
+            break
+        if now - mtime < protect_s:
+            continue
+        try:
+            p.unlink()
+        except FileNotFoundError:
+            continue
+        total -= size
+        freed += size
+        n += 1
+    return freed, n, total
+
+
+def content_id(path):
+    """sha256 del contenido (los blobs del cache ya lo llevan en el nombre)."""
+    path = Path(path)
+    if path.parent == BROLL_DIR / "blobs":
+        return path.stem
+    return file_sha256(path)
+
+
+def cached_segment(key, build):
+    """
+    Segmento de escena ya codificado en .cache/segments/<key>.mp4.
+    `build(out)` se llama sólo si no está; se reusa entre renders.
+    """
+    path = SEGMENTS_DIR / f"{key}.mp4"
+    with _key_lock("segment:" + key):
+        if path.exists():
+            _count("hit", stats=SEGMENT_STATS)
+            annotate(cache="hit")
+            os.utime(path)  # LRU por mtime
+            return str(path)
+        _count("miss", stats=SEGMENT_STATS)
+        annotate(cache="miss")
+        SEGMENTS_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}.mp4")
+        try:
+            build(str(tmp))
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+    freed, _, _ = _evict_lru(SEGMENTS_DIR, SEGMENTS_MAX_BYTES)
+    if freed:
+        print(f"[cache] segmentos evictados {freed / 1e6:.1f} MB")
+    return str(path)
+
+
+def broll_cache_report():
+    s = dict(BROLL_STATS)
+    total = s["hit"] + s["miss"]
+    rate = (100.0 * s["hit"] / total) if total else 0.0
+    print(f"[cache] broll hits={s['hit']} misses={s['miss']} ({rate:.0f}% hit) "
+          f"descargado={s['bytes_downloaded'] / 1e6:.1f} MB evictados={s['evicted']}")
+    return s
+
+
+# ---------------------------
+# Cache de búsquedas (Pexels)
+# ---------------------------
+
+def search_key(kind, params):
+    # la query se normaliza (minúsculas/espacios) para que "Sangre  " == "sangre"
+    norm = dict(params)
+    if "query" in norm:
+        norm["query"] = " ".join(str(norm["query"]).lower().split())
+    return _sha(json.dumps({"kind": kind, **norm}, sort_keys=True, ensure_ascii=False))
+
+
+def reset_search_memo():
+    """
+    Memo nuevo para el render en curso (llamar al inicio de cada render).
+    Lo ven los hilos lanzados después con tracing.submit; otros renders no.
+    """
+    memo = {}
+    _SEARCH_MEMO.set(memo)
+    return memo
+
+
+def cached_search(kind, params, fetch, ttl=None):
+    """
+    Resultado de `fetch(params)` (JSON) cacheado por (kind, params):
+    - en memoria: cada query se manda a la API como mucho una vez por render
+      (también los errores: no se reintenta en el mismo render)
+    - en disco: .cache/search/<sha>.json con TTL (SEARCH_CACHE_TTL_S)
+    """
+    ttl = SEARCH_TTL_S if ttl is None else ttl
+    key = search_key(kind, params)
+    memo = _SEARCH_MEMO.get()
+    if memo is None:
+        memo = {}  # fuera de un render: sin dedup en memoria
+    with _key_lock("search:" + key):
+        if key in memo:
+            _count("memo", stats=SEARCH_STATS)
+            annotate(cache="memo")
+            hit = memo[key]
+            if isinstance(hit, Exception):
+                raise hit
+            return hit
+
+        path = SEARCH_DIR / f"{key}.json"
+        if ttl > 0 and path.exists():
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+                if time.time() - entry.get("saved_at", 0) < ttl:
+                    _count("disk", stats=SEARCH_STATS)
+                    annotate(cache="disk")
+                    memo[key] = entry["data"]
+                    return entry["data"]
+            except Exception:
+                pass  # entrada corrupta: se vuelve a pedir
+
+        _count("api", stats=SEARCH_STATS)
+        annotate(cache="api")
+        try:
+            data = fetch(params)
+        except Exception as e:
+            memo[key] = e
+            raise
+        memo[key] = data
+        write_atomic(path, json.dumps(
+            {"saved_at": int(time.time()), "kind": kind, "params": params, "data": data},
+            ensure_ascii=False))
+        return data
+
+
+def search_cache_report():
+    s = dict(SEARCH_STATS)
+    print(f"[cache] search api={s['api']} disco={s['disk']} dedup={s['memo']}")
+    return s
+
+
+# ---------------------------
+# Cache de imágenes IA
+# ---------------------------
+
+def ia_image_key(prompt, negative, model, params):
+    # misma imagen pedida al mismo modelo con los mismos parámetros -> misma clave
+    return _sha(json.dumps({"prompt": prompt, "negative": negative, "model": model,
+                            "params": params}, sort_keys=True, ensure_ascii=False))
+
+
+def cached_ia_image(key):
+    """Ruta de la imagen ya generada para `key` (o None)."""
+    for suffix in IA_SUFFIXES:
+        path = IA_DIR / f"{key}{suffix}"
+        if path.exists():
+            _count("hit", stats=IA_STATS)
+            annotate(cache="hit")
+            os.utime(path)  # LRU por mtime
+            return str(path)
+    return None
+
+
+def store_ia_image(key, data, suffix):
+    """Guarda la imagen generada en .cache/ia/<key><suffix> (y evicta por LRU)."""
+    _count("miss", stats=IA_STATS)
+    path = write_atomic(IA_DIR / f"{key}{suffix}", data)
+    freed, _, _ = _evict_lru(IA_DIR, IA_MAX_BYTES)
+    if freed:
+        print(f"[cache] imágenes IA evictadas {freed / 1e6:.1f} MB")
+    return str(path)
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import shutil
+import socket
+import threading
+import traceback
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from src.cache import write_atomic
+
+# spool: un .json por trabajo; el estado es la carpeta donde está
+#   SPOOL/queue/<id>.json  -> pendiente
+#   SPOOL/running/<id>.json -> tomado por un daemon (rename atómico); lleva el
+#                             dueño (host, pid) y su mtime es el latido del dueño
+#   SPOOL/done|failed/<id>.json -> terminado (con resultado o error)
+#   SPOOL/work/<id>/       -> intermedios del render (se borran si sale bien; si
+#                             falla quedan y requeue_job retoma desde ahí)
+STATES = ("queue", "running", "done", "failed")
+POLL_S = 1.0
+HEARTBEAT_S = 30.0  # cada cuánto el daemon toca sus trabajos en running/
+STALE_S = 120.0     # sin latido hace tanto: el dueño murió (o quedó colgado) y se reencola
+
+
+def _dir(spool, state):
+    d = Path(spool) / state
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+def _read(path):
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def _write(path, job):
+    write_atomic(path, json.dumps(job, ensure_ascii=False, indent=2))
+
+
+def submit_job(spool, audio, out=None, options=None):
+    """Encola un render (rutas absolutas: el daemon puede correr en otro cwd)."""
+    ns = time.time_ns()
+    job_id = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(ns // 10**9))}-{ns % 10**9:09d}-{os.getpid()}"
+    out = out or str(Path(spool) / "out" / f"short-{job_id}.mp4")
+    job = {
+        "id": job_id,
+        "audio": str(Path(audio).resolve()),
+        "out": str(Path(out).resolve()),
+        "options": options or {},
+        "submitted_at": time.time(),
+    }
+    _write(_dir(spool, "queue") / f"{job_id}.json", job)
+    return job_id
+
+
+def _owner():
+    return {"host": socket.gethostname(), "pid": os.getpid()}
+
+
+def _pid_alive(pid):
+    if not pid or os.name == "nt":
+        return True  # en Windows os.kill(pid, 0) no es una consulta: sólo cuenta el latido
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # existe, es de otro usuario
+    return True
+
+
+def requeue_job(spool, job_id):
+    """
+    Vuelve a encolar un trabajo fallido con el mismo id: el render usa el
+    mismo SPOOL/work/<id> y retoma desde la última etapa terminada.
+    """
+    src = Path(spool) / "failed" / f"{job_id}.json"
+    if not src.exists():
+        raise FileNotFoundError(f"no hay trabajo fallido {job_id} en {spool}")
+    job = _read(src)
+    job["attempts"] = job.get("attempts", 1) + 1
+    for k in ("error", "traceback", "started_at", "finished_at", "elapsed_s", "worker", "owner"):
+        job.pop(k, None)
+    _write(_dir(spool, "queue") / src.name, job)
+    src.unlink()
+    return job
+
+
+def _claim(spool):
+    """Toma el trabajo más viejo de la cola; None si no hay (o lo tomó otro daemon)."""
+    for p in sorted(_dir(spool, "queue").glob("*.json")):
+        dst = _dir(spool, "running") / p.name
+        try:
+            os.rename(p, dst)
+        except OSError:
+            continue  # lo tomó otro proceso
+        try:
+            job = _read(dst)
+            job["owner"] = _owner()  # de acá en adelante lo protege el latido
+            _write(dst, job)
+            return dst, job
+        except Exception as e:
+            print(f"[daemon] trabajo ilegible {p.name}: {e}")
+            os.replace(dst, _dir(spool, "failed") / p.name)
+    return None
+
+
+def _reap(spool):
+    """
+    Devuelve a la cola los trabajos de running/ huérfanos: el pid dueño ya no
+    existe (mismo host) o no hay latido hace STALE_S (cualquier host). Los de
+    daemons vivos no se tocan.
+    """
+    me = _owner()
+    now = time.time()
+    for p in _dir(spool, "running").glob("*.json"):
+        try:
+            st = p.stat()
+            owner = _read(p).get("owner") or {}
+        except (OSError, ValueError):
+            continue  # ya se movió o está a medio escribir
+        if owner == me:
+            continue
+        dead = owner.get("host") == me["host"] and not _pid_alive(owner.get("pid"))
+        # ctime: el rename de _claim la actualiza aunque todavía no se haya escrito el dueño
+        stale = now - max(st.st_mtime, st.st_ctime) > STALE_S
+        if not (dead or stale):
+            continue
+        try:
+            os.rename(p, _dir(spool, "queue") / p.name)
+        except OSError:
+            continue  # lo reencoló otro daemon
+        who = f"{owner.get('host')}:{owner.get('pid')}" if owner else "sin dueño"
+        print(f"[daemon] reencolando {p.stem} ({who}, {'muerto' if dead else 'sin latido'})")
+
+
+def _run_job(spool, path, job, render):
+    job_id = job["id"]
+    work = Path(spool) / "work" / job_id
+    job.update(started_at=time.time(), worker=threading.current_thread().name)
+    _write(path, job)
+    print(f"[daemon] ▶ {job_id} {job['audio']}")
+    try:
+        Path(job["out"]).parent.mkdir(parents=True, exist_ok=True)
+        job["result"] = render(job["audio"], job["out"], str(work), **job["options"])
+        state = "done"
+        shutil.rmtree(work, ignore_errors=True)
+    except Exception as e:
+        job["error"] = f"{type(e).__name__}: {e}"
+        job["traceback"] = traceback.format_exc()
+        state = "failed"
+    job["finished_at"] = time.time()
+    job["elapsed_s"] = round(job["finished_at"] - job["started_at"], 2)
+    _write(_dir(spool, state) / path.name, job)
+    path.unlink(missing_ok=True)
+    print(f"[daemon] {'✔' if state == 'done' else '✘'} {job_id} ({job['elapsed_s']}s)"
+          + (f" {job['error']}" if state == "failed" else ""))
+
+
+def serve(spool, render, workers=1, warm=None, poll_s=POLL_S):
+    """
+    Atiende la cola de `spool` con `workers` renders simultáneos en este
+    proceso, así los modelos (Whisper, MiniLM) se cargan una sola vez.
+    - render(audio, out, work_dir, **options) -> ruta del mp4
+    - warm(): precarga de modelos antes de tomar trabajos
+    Ctrl+C deja de tomar trabajos y espera a los que están corriendo.
+    - varios daemons pueden compartir el spool: cada uno late sobre sus
+      trabajos y sólo se reencolan los de daemons muertos o colgados
+    """
+    for state in STATES:
+        _dir(spool, state)
+    # trabajos que quedaron a medias (daemon cortado): vuelven a la cola
+    _reap(spool)
+    if warm:
+        t0 = time.time()
+        warm()
+        print(f"[daemon] modelos cargados en {time.time() - t0:.1f}s")
+    print(f"[daemon] escuchando {Path(spool).resolve()} (workers={workers})")
+
+    slots = threading.Semaphore(workers)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+    mine = set()  # trabajos en running/ de este proceso
+    mine_lock = threading.Lock()
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(HEARTBEAT_S):
+            with mine_lock:
+                paths = list(mine)
+            for p in paths:
+                try:
+                    os.utime(p)
+                except FileNotFoundError:
+                    pass  # terminó entre medio
+            _reap(spool)
+
+    def run(path, job):
+        try:
+            _run_job(spool, path, job, render)
+        finally:
+            with mine_lock:
+                mine.discard(path)
+            slots.release()
+
+    threading.Thread(target=heartbeat, name="heartbeat", daemon=True).start()
+
+    try:
+        while True:
+            if not slots.acquire(timeout=poll_s):
+                continue
+            claimed = _claim(spool)
+            if claimed is None:
+                slots.release()
+                time.sleep(poll_s)
+                continue
+            with mine_lock:
+                mine.add(claimed[0])
+            pool.submit(run, *claimed)
+    except KeyboardInterrupt:
+        print("[daemon] cortando: espero los renders en curso…")
+    finally:
+        pool.shutdown(wait=True)
+        stop.set()
+
+
+def job_status(spool):
+    """[{id, state, ...}] de todos los trabajos del spool, del más viejo al más nuevo."""
+    jobs = []
+    for state in STATES:
+        d = Path(spool) / state
+        if not d.exists():
+            continue
+        for p in d.glob("*.json"):
+            try:
+                job = _read(p)
+            except Exception:
+                job = {"id": p.stem}
+            job["state"] = state
+            jobs.append(job)
+    return sorted(jobs, key=lambda j: j.get("submitted_at", 0))
+
+
+def print_status(spool):
+    jobs = job_status(spool)
+    counts = {s: sum(j["state"] == s for j in jobs) for s in STATES}
+    print("[daemon] " + " ".join(f"{s}={n}" for s, n in counts.items()))
+    for j in jobs:
+        extra = j.get("result") or j.get("error") or j.get("audio", "")
+        took = f" {j['elapsed_s']}s" if "elapsed_s" in j else ""
+        print(f"  {j['id']}  {j['state']:<7}{took}  {extra}")
+    return jobs
@@ -0,0 +1,124 @@
+import json
+import threading
+from src.cache import CACHE_ROOT, write_atomic, file_lock
+
+EMB_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+WORDVEC_DIR = CACHE_ROOT / "wordvec" / EMB_MODEL_NAME.replace("/", "__")
+
+_EMB_MODEL = None
+_EMB_LOCK = threading.Lock()
+
+# store de vectores de palabras: vectors.f32 (filas float32, append-only) + vocab.json
+_STORE = {"vocab": None, "vecs": None, "dim": None}
+_STORE_LOCK = threading.Lock()
+
+
+def get_emb_model():
+    # MiniLM se carga la primera vez que se usa (no al importar), una vez por proceso
+    global _EMB_MODEL
+    if _EMB_MODEL is None:
+        with _EMB_LOCK:
+            if _EMB_MODEL is None:
+                from sentence_transformers import SentenceTransformer
+                _EMB_MODEL = SentenceTransformer(EMB_MODEL_NAME)
+    return _EMB_MODEL
+
+
+def encode(texts):
+    """Embeddings normalizados (np.float32, shape (N, dim)) en UNA llamada al modelo."""
+    import numpy as np
+    if not texts:
+        return np.zeros((0, _STORE["dim"] or 0), dtype=np.float32)
+    vecs = get_emb_model().encode(list(texts), convert_to_numpy=True,
+                                  normalize_embeddings=True, batch_size=64)
+    return np.asarray(vecs, dtype=np.float32)
+
+
+def _open_store():
+    """(Re)abre vocab.json + vectors.f32 como memmap de sólo lectura."""
+    import numpy as np
+    vocab_path = WORDVEC_DIR / "vocab.json"
+    vec_path = WORDVEC_DIR / "vectors.f32"
+    vocab, vecs, dim = {}, None, None
+    if vocab_path.exists() and vec_path.exists():
+        try:
+            meta = json.loads(vocab_path.read_text(encoding="utf-8"))
+            dim = int(meta["dim"])
+            n_rows = vec_path.stat().st_size // (4 * dim)
+            # sólo filas que ya están escritas en el archivo de vectores
+            words = meta["words"][:n_rows]
+            vocab = {w: i for i, w in enumerate(words)}
+            if n_rows:
+                vecs = np.memmap(vec_path, dtype=np.float32, mode="r", shape=(n_rows, dim))
+        except Exception as e:
+            print("[emb] store de palabras ilegible, se ignora:", e)
+            vocab, vecs, dim = {}, None, None
+    _STORE.update(vocab=vocab, vecs=vecs, dim=dim)
+
+
+def lookup_word_vectors(words):
+    """Devuelve ({palabra: vector}, [faltantes]) usando el store en disco."""
+    with _STORE_LOCK:
+        if _STORE["vocab"] is None:
+            _open_store()
+        vocab, vecs = _STORE["vocab"], _STORE["vecs"]
+        found, missing = {}, []
+        for w in words:
+            row = vocab.get(w)
+            if row is None:
+                missing.append(w)
+            else:
+                found[w] = vecs[row]
+        return found, missing
+
+
+def store_word_vectors(words, vecs):
+    """Agrega palabras nuevas al store (append de filas + vocab atómico)."""
+    if not words:
+        return
+    import numpy as np
+    vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+    WORDVEC_DIR.mkdir(parents=True, exist_ok=True)
+    vocab_path = WORDVEC_DIR / "vocab.json"
+    vec_path = WORDVEC_DIR / "vectors.f32"
+    with _STORE_LOCK:
+        try:
+            with file_lock(str(WORDVEC_DIR / ".lock")):
+                _open_store()  # otro proceso pudo agregar palabras
+                if _STORE["dim"] not in (None, vecs.shape[1]):
+                    print("[emb] dimensión distinta en el store, no se guarda")
+                    return
+                known = _STORE["vocab"]
+                new = [(w, v) for w, v in zip(words, vecs) if w not in known]
+                if not new:
+                    return
+                order = [w for w, _ in sorted(known.items(), key=lambda kv: kv[1])]
+                _STORE.update(vecs=None)  # soltar el memmap antes de tocar el archivo
+                with open(vec_path, "ab") as f:
+                    # filas huérfanas (se cortó antes de escribir el vocab): se descartan
+                    if f.tell() != len(order) * 4 * vecs.shape[1]:
+                        f.truncate(len(order) * 4 * vecs.shape[1])
+                    f.write(np.stack([v for _, v in new]).tobytes())
+                write_atomic(vocab_path, json.dumps(
+                    {"model": EMB_MODEL_NAME, "dim": int(vecs.shape[1]),
+                     "words": order + [w for w, _ in new]}, ensure_ascii=False))
+        except (OSError, TimeoutError) as e:
+            print("[emb] no se pudo guardar el store de palabras:", e)
+        _STORE["vocab"] = None  # se reabre en la próxima consulta
+
+
+def top_k_per_scene(scene_vecs, word_vecs, cand_idx, top_k=3):
+    """
+    Top-k candidatas por escena con una sola multiplicación de matrices.
+    - scene_vecs (S, d), word_vecs (V, d), cand_idx[i] = índices de palabras de la escena i
+    """
+    import numpy as np
+    sims = scene_vecs @ word_vecs.T                       # (S, V) coseno (vectores normalizados)
+    # redondeo + desempate por orden en la frase: el resultado no depende de
+    # qué escenas se codificaron juntas (ruido de float entre batches)
+    sims = np.round(sims, 5)
+    out = []
+    for i, idx in enumerate(cand_idx):
+        order = np.argsort(-sims[i, idx], kind="stable")[:top_k]
+        out.append([int(idx[j]) for j in order])
+    return out
@@ -0,0 +1,31 @@
+import os
+import threading
+
+_LOCK = threading.Lock()
+_LOADED = False
+
+
+def load_env():
+    """Carga .env una sola vez por proceso (python-dotenv es opcional)."""
+    global _LOADED
+    if _LOADED:
+        return
+    with _LOCK:
+        if _LOADED:
+            return
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except ImportError:
+            pass
+        _LOADED = True
+
+
+def env(name, default=None):
+    """os.getenv con .env ya cargado (las perillas de # --- CONFIG --- se leen con esto)."""
+    load_env()
+    return os.getenv(name, default)
+
+
+# los módulos leen su CONFIG al importarse: .env tiene que estar cargado antes
+load_env()
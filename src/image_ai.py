@@ -1,9 +1,26 @@
-import requests, time, os
+import time
+import queue
+import shutil
+import threading
+from contextvars import copy_context
 from pathlib import Path
-from dotenv import load_dotenv
-load_dotenv()
+from src.env import env
+from src import net
+from src.cache import ia_image_key, cached_ia_image, store_ia_image
+from src.tracing import span, annotate
 
-HF_TOKEN = os.getenv("HF_TOKEN")
+# --- CONFIG ---
+HF_API = env("HF_API_BASE", "https://api-inference.huggingface.co").rstrip("/")
+HF_MODELS = (
+    "stabilityai/stable-diffusion-xl-base-1.0",
+    "stabilityai/stable-diffusion-2-1",
+    "stabilityai/sd-turbo",
+)
+HF_PARAMS = {"num_inference_steps": 28, "guidance_scale": 7.0}
+HF_HEDGE = env("HF_HEDGE", "0") == "1"                     # 1 = modelos en paralelo (gasta más cuota)
+HF_HEDGE_DELAY_S = float(env("HF_HEDGE_DELAY_S", "8"))     # sin respuesta en X s -> se suma el siguiente modelo
+HF_LATENCY_BUDGET_S = float(env("HF_LATENCY_BUDGET_S", "45"))  # tope de espera del modo hedge
+HF_WARMUP_MAX_S = 20  # espera máxima por un 503 "warming-up"
 
 
 def build_image_prompt_from_sentence(sentence: str):
@@ -45,58 +62,156 @@ def build_image_prompt_from_sentence(sentence: str):
     return prompt, negative
 
 
-# Reemplaza tu generate_image_hf por este
-def generate_image_hf(
-    sentence_text,
-    out_path="tmp_broll/ia_first.jpg",
-    models=None,
-    retries_per_model=2,
-    wait_s=6,
-):
-    if not HF_TOKEN:
-        raise RuntimeError("Falta HF_TOKEN en el .env")
+def image_suffix(data):
+    """Extensión según los magic bytes; None si no es una imagen (JSON de error, HTML...)."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return ".png"
+    if data[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return None
 
-    models = models or [
-        "stabilityai/stable-diffusion-xl-base-1.0",
-        "stabilityai/stable-diffusion-2-1",
-        "stabilityai/sd-turbo",
-    ]
-
-    pos_prompt, neg_prompt = build_image_prompt_from_sentence(sentence_text)
-
-    headers = {"Authorization": f"Bearer {HF_TOKEN}"}
-    payload = {
-        "inputs": pos_prompt,
-        "parameters": {
-            "negative_prompt": neg_prompt,
-            "num_inference_steps": 28,
-            "guidance_scale": 7.0,
-        },
-    }
 
+def _call_model(model, headers, payload, key, deadline, retries, wait_s):
+    """
+    Pide la imagen a un modelo hasta tener bytes válidos o agotar reintentos/tiempo.
+    La guarda en el cache apenas llega (aunque otro modelo haya ganado antes).
+    """
+    url = f"{HF_API}/models/{model}"
     last_err = None
-    for model in models:
-        url = f"https://api-inference.huggingface.co/models/{model}"
-        print(f"[hf] intentando modelo: {model}")
-        for attempt in range(1, retries_per_model + 1):
+    with span("hf_model", "net", model=model):
+        for attempt in range(1, retries + 1):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
             try:
-                r = requests.post(url, headers=headers, json=payload, timeout=120)
+                # el 503 "warming-up" se maneja acá con el estimated_time de HF
+                r = net.post(url, headers=headers, json=payload, timeout=min(120, max(1, left)),
+                             retry_status=(429, 500, 502, 504))
                 if r.status_code == 503:
-                    et = (r.json().get("estimated_time", wait_s) if r.headers.get("content-type","").startswith("application/json") else wait_s)
+                    et = (r.json().get("estimated_time", wait_s) if r.headers.get("content-type", "").startswith("application/json") else wait_s)
                     print(f"[hf] 503 warming-up ({model}), retry en {int(et)}s…")
-                    time.sleep(min(max(3, int(et)), 20))
+                    time.sleep(max(0, min(max(3, int(et)), HF_WARMUP_MAX_S, deadline - time.monotonic())))
                     continue
-                if r.status_code in (401,403,404):
-                    print(f"[hf] {r.status_code} en {model}: {r.text[:200]}")
-                    break
+                if r.status_code in (401, 403, 404):
+                    raise RuntimeError(f"{r.status_code} en {model}: {r.text[:200]}")
                 r.raise_for_status()
-                Path(out_path).parent.mkdir(parents=True, exist_ok=True)
-                with open(out_path, "wb") as f:
-                    f.write(r.content)
-                print(f"[hf] imagen generada con {model} -> {out_path}")
-                return out_path
+                suffix = image_suffix(r.content)
+                if suffix is None:
+                    raise ValueError(f"respuesta sin imagen ({r.headers.get('content-type')})")
+                annotate(bytes=len(r.content))
+                return store_ia_image(key, r.content, suffix)
+            except RuntimeError:
+                raise  # sin permiso / modelo inexistente: no tiene sentido reintentar
             except Exception as e:
                 last_err = e
                 print(f"[hf] error ({model}, intento {attempt}): {e}")
-                time.sleep(wait_s)
-    raise last_err or RuntimeError("No se pudo generar imagen IA con ninguno de los modelos")
\ No newline at end of file
+                time.sleep(max(0, min(wait_s, deadline - time.monotonic())))
+    raise last_err or TimeoutError(f"{model} sin imagen a tiempo")
+
+
+def _first_image(models, call, deadline, hedge_delay_s):
+    """
+    Lanza `call(model)` en orden, escalonado: el siguiente modelo arranca si en
+    `hedge_delay_s` no llegó nada o en cuanto uno falla. Gana la primera imagen
+    válida; los que siguen corriendo terminan en segundo plano (y dejan su
+    imagen en el cache). Devuelve (modelo, ruta).
+    """
+    results = queue.Queue()
+    errors = []
+    started, running = 0, 0
+    next_at = time.monotonic()
+
+    def run(model):
+        try:
+            results.put((model, call(model), None))
+        except Exception as e:
+            results.put((model, None, e))
+
+    while True:
+        now = time.monotonic()
+        if started < len(models) and (now >= next_at or running == 0):
+            model = models[started]
+            print(f"[hf] intentando modelo: {model}")
+            # hilos daemon: una respuesta lenta no retiene el cierre del proceso
+            threading.Thread(target=copy_context().run, args=(run, model), daemon=True).start()
+            started += 1
+            running += 1
+            next_at = now + hedge_delay_s
+        if running == 0:
+            raise errors[-1] if errors else RuntimeError("No se pudo generar imagen IA con ninguno de los modelos")
+        if now >= deadline:
+            raise TimeoutError(f"sin imagen IA en el presupuesto ({', '.join(models[:started])})")
+        wake = deadline if started >= len(models) else min(next_at, deadline)
+        try:
+            # sin hedge ni presupuesto no hay plazo: se espera al modelo en curso
+            model, path, err = results.get(timeout=None if wake == float("inf")
+                                           else max(0.01, wake - now))
+        except queue.Empty:
+            continue
+        running -= 1
+        if err is None:
+            return model, path
+        print(f"[hf] {model} descartado: {err}")
+        errors.append(err)
+        next_at = time.monotonic()  # falló: el siguiente arranca ya
+
+
+def generate_image_hf(
+    sentence_text,
+    out_path="tmp_broll/ia_first.jpg",
+    models=None,
+    retries_per_model=2,
+    wait_s=6,
+    hedge=None,
+    budget_s=None,
+):
+    """
+    Imagen IA para la frase en `out_path`.
+    - cache por (prompt, negative, modelo, parámetros): la misma frase no se
+      vuelve a generar (sirve la de cualquier modelo de la lista, en orden)
+    - hedge: si el modelo preferido no responde en HF_HEDGE_DELAY_S se suma el
+      siguiente en paralelo y gana la primera imagen válida; sin hedge, un
+      modelo tras otro como antes (default: HF_HEDGE, apagado)
+    - budget_s: espera máxima total; pasado eso TimeoutError (la escena usa
+      stock). Con hedge, default HF_LATENCY_BUDGET_S; sin hedge, sin tope
+    """
+    models = list(models or HF_MODELS)
+    hedge = HF_HEDGE if hedge is None else hedge
+    if budget_s is None:
+        budget_s = HF_LATENCY_BUDGET_S if hedge else float("inf")
+
+    pos_prompt, neg_prompt = build_image_prompt_from_sentence(sentence_text)
+    keys = {m: ia_image_key(pos_prompt, neg_prompt, m, HF_PARAMS) for m in models}
+
+    path, model = None, None
+    for m in models:
+        path = cached_ia_image(keys[m])
+        if path:
+            model = m
+            print(f"[hf] imagen en cache ({m})")
+            break
+
+    if path is None:
+        hf_token = env("HF_TOKEN")
+        if not hf_token:
+            raise RuntimeError("Falta HF_TOKEN en el .env")
+        headers = {"Authorization": f"Bearer {hf_token}"}
+        payload = {
+            "inputs": pos_prompt,
+            "parameters": {"negative_prompt": neg_prompt, **HF_PARAMS},
+        }
+        annotate(cache="miss")
+        deadline = time.monotonic() + budget_s
+        model, path = _first_image(
+            models,
+            lambda m: _call_model(m, headers, payload, keys[m], deadline, retries_per_model, wait_s),
+            deadline,
+            HF_HEDGE_DELAY_S if hedge else float("inf"),
+        )
+
+    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(path, out_path)
+    print(f"[hf] imagen generada con {model} -> {out_path}")
+    return out_path
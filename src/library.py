@@ -0,0 +1,202 @@
+import os
+import json
+import threading
+from pathlib import Path
+from src.env import env
+from src.cache import CACHE_ROOT, write_atomic, file_lock, file_sha256
+from src.embeddings import EMB_MODEL_NAME, encode
+from src.render import W, H, probe_media
+from src.tracing import span, annotate
+
+# --- CONFIG ---
+LIBRARY_DIR = Path(env("BROLL_LIBRARY", "assets"))  # clips propios (con licencia)
+LIBRARY_INDEX_DIR = CACHE_ROOT / "library"
+LIBRARY_MIN_SIM = float(env("LIBRARY_MIN_SIM", "0.45"))  # coseno mínimo frase <-> clip
+LIBRARY_EXTS = (".mp4", ".mov", ".m4v", ".webm")
+INDEX_VERSION = 1
+
+_INDEX = {"key": None, "clips": None, "vecs": None, "dur": None, "big": None}
+_INDEX_LOCK = threading.Lock()
+
+
+def clip_description(path):
+    """
+    Texto que describe el clip, para embeber:
+    - <clip>.json: {"description": "...", "tags": [...]}
+    - <clip>.txt: descripción libre
+    - si no hay sidecar, el nombre del archivo ("glucosa_en_sangre.mp4")
+    """
+    path = Path(path)
+    sidecar = path.with_suffix(".json")
+    if sidecar.exists():
+        meta = json.loads(sidecar.read_text(encoding="utf-8"))
+        parts = [meta.get("description") or "", ", ".join(meta.get("tags") or [])]
+        text = ". ".join(p.strip() for p in parts if p and p.strip())
+        if text:
+            return text
+    sidecar = path.with_suffix(".txt")
+    if sidecar.exists():
+        text = " ".join(sidecar.read_text(encoding="utf-8").split())
+        if text:
+            return text
+    return " ".join(path.stem.replace("_", " ").replace("-", " ").split())
+
+
+def _stamp(path):
+    # cambia si cambia el clip o su sidecar (y entonces se re-indexa)
+    st = path.stat()
+    side = [p.stat().st_mtime_ns for p in (path.with_suffix(".json"), path.with_suffix(".txt"))
+            if p.exists()]
+    return [st.st_size, st.st_mtime_ns, max(side, default=0)]
+
+
+def build_index(root=None):
+    """
+    Indexa la biblioteca local (offline, fuera del render): por clip, ffprobe
+    (duración, resolución, fps), sha256 y el embedding MiniLM de su descripción.
+    - vectors.npy: matriz float32 (N, dim), fila i = clips[i] de index.json
+    - sólo se procesan los clips nuevos o cambiados; los borrados salen del índice
+    Devuelve cuántos clips quedaron indexados.
+    """
+    import numpy as np
+    root = Path(root or LIBRARY_DIR)
+    files = sorted(p for p in root.rglob("*") if p.suffix.lower() in LIBRARY_EXTS and p.is_file())
+    LIBRARY_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+
+    with file_lock(str(LIBRARY_INDEX_DIR / ".lock"), timeout=600.0, stale_s=3600.0):
+        old_clips, old_vecs = _read_index()
+        old = {c["path"]: (c, old_vecs[i]) for i, c in enumerate(old_clips or [])}
+
+        clips, vecs, todo = [], [], []
+        for p in files:
+            path = str(p.resolve())
+            stamp = _stamp(p)
+            prev = old.get(path)
+            if prev and prev[0]["stamp"] == stamp:
+                clips.append(prev[0])
+                vecs.append(prev[1])
+                continue
+            try:
+                info = probe_media(p)
+                text = clip_description(p)
+            except Exception as e:
+                print(f"[library] se saltea {p}: {e}")
+                continue
+            clips.append({"path": path, "stamp": stamp, "sha256": file_sha256(p),
+                          "text": text, **info})
+            vecs.append(None)
+            todo.append(len(clips) - 1)
+            print(f"[library] + {p.name}: {text}")
+
+        if todo:
+            new_vecs = encode([clips[i]["text"] for i in todo])
+            for i, v in zip(todo, new_vecs):
+                vecs[i] = v
+        matrix = (np.stack(vecs).astype(np.float32) if vecs
+                  else np.zeros((0, 0), dtype=np.float32))
+
+        # primero la matriz y después el JSON: el JSON referencia a la matriz por tamaño
+        tmp = LIBRARY_INDEX_DIR / f".vectors.{os.getpid()}.npy"
+        np.save(tmp, matrix)
+        os.replace(tmp, LIBRARY_INDEX_DIR / "vectors.npy")
+        write_atomic(LIBRARY_INDEX_DIR / "index.json", json.dumps(
+            {"v": INDEX_VERSION, "model": EMB_MODEL_NAME, "root": str(root.resolve()),
+             "rows": len(clips), "clips": clips}, ensure_ascii=False))
+
+    gone = len(set(old) - {c["path"] for c in clips})
+    print(f"[library] {len(clips)} clips indexados ({len(todo)} nuevos o cambiados, {gone} fuera)")
+    return len(clips)
+
+
+def _read_index():
+    """(clips, matriz) tal como están en disco; (None, None) si no hay índice válido."""
+    import numpy as np
+    meta_path = LIBRARY_INDEX_DIR / "index.json"
+    vec_path = LIBRARY_INDEX_DIR / "vectors.npy"
+    if not meta_path.exists() or not vec_path.exists():
+        return None, None
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        # entero en memoria (N x 384 float32 es chico) y sin mmap: en Windows
+        # no se podría reemplazar el archivo mientras un render lo tiene abierto
+        vecs = np.load(vec_path)
+    except Exception as e:
+        print("[library] índice ilegible, se ignora:", e)
+        return None, None
+    if (meta.get("v") != INDEX_VERSION or meta.get("model") != EMB_MODEL_NAME
+            or vecs.shape[0] != meta.get("rows")):
+        return None, None  # otro modelo / a medio escribir: se re-indexa
+    return meta["clips"], vecs
+
+
+def _load():
+    # índice + arrays de metadatos (duración, cubre W x H) para filtrar sin loops
+    import numpy as np
+    meta_path = LIBRARY_INDEX_DIR / "index.json"
+    try:
+        key = meta_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _INDEX_LOCK:
+        if _INDEX["key"] != key:
+            clips, vecs = _read_index()
+            dur = big = None
+            if clips:
+                dur = np.array([c["duration"] for c in clips], dtype=np.float32)
+                big = np.array([c["width"] >= W and c["height"] >= H for c in clips], dtype=bool)
+            _INDEX.update(key=key, clips=clips, vecs=vecs, dur=dur, big=big)
+        return dict(_INDEX)
+
+
+def load_index():
+    """Índice en memoria (se relee sólo si cambió en disco). (clips, matriz) o (None, None)."""
+    idx = _load()
+    return (idx["clips"], idx["vecs"]) if idx else (None, None)
+
+
+def match_scenes(texts, durs, used=None, min_sim=None):
+    """
+    Clip local para cada frase, antes de ir a la red: una matmul frases x
+    biblioteca y, escena por escena, el clip más parecido que no se haya usado
+    en este render y supere `min_sim`. Devuelve [asset | None] (None -> Pexels).
+    - durs[i]: duración de la escena; sólo entran clips que la cubren sin
+      loop y que cubren W x H sin escalar hacia arriba (como las renditions
+      que se eligen de Pexels)
+    - used: rutas ya elegidas en el render (se actualiza)
+    """
+    idx = _load()
+    if not idx or not idx["clips"] or not texts:
+        return [None] * len(texts)
+    import numpy as np
+    clips = idx["clips"]
+    min_sim = LIBRARY_MIN_SIM if min_sim is None else min_sim
+    used = set() if used is None else used
+    with span("library_match", scenes=len(texts), clips=len(clips)):
+        sims = encode(list(texts)) @ idx["vecs"].T       # (S, N) coseno (vectores normalizados)
+        ok = (sims >= min_sim) & idx["big"] & (idx["dur"] >= np.asarray(durs, dtype=np.float32)[:, None])
+        out = []
+        for i in range(len(texts)):
+            pick = None
+            # sólo se ordenan las que pasan los filtros (pocas), no toda la biblioteca
+            cand = np.flatnonzero(ok[i])
+            for j in cand[np.argsort(-sims[i, cand], kind="stable")]:
+                clip = clips[j]
+                if clip["path"] in used or not os.path.exists(clip["path"]):
+                    continue
+                used.add(clip["path"])
+                pick = {"kind": "video", "path": clip["path"], "url": None,
+                        "sha256": clip["sha256"], "library_sim": round(float(sims[i, j]), 3)}
+                break
+            out.append(pick)
+        annotate(hits=sum(p is not None for p in out))
+        return out
+
+
+def library_report():
+    clips, _ = load_index()
+    if not clips:
+        print("[library] sin índice (build_short.py --index-library)")
+        return {"clips": 0}
+    total = sum(c["duration"] for c in clips)
+    print(f"[library] {len(clips)} clips, {total / 60:.1f} min")
+    return {"clips": len(clips), "duration_s": total}
@@ -2,47 +2,37 @@
 import os
 import random
 import time
-import requests, json
+import json
+import threading
 from pathlib import Path
 from urllib.parse import urlparse
+from src.render import music_filter, measure_loudness, loudnorm_target
+from src.env import env
+from src.tracing import annotate
+from src import net
 
 
-
-OPENVERSE_CLIENT_ID     = os.getenv("OPENVERSE_CLIENT_ID")
-OPENVERSE_CLIENT_SECRET = os.getenv("OPENVERSE_CLIENT_SECRET")
-
-TOKEN_URL = "https://api.openverse.org/v1/auth_tokens/token/"
-AUDIO_URL = "https://api.openverse.org/v1/audio/"
+OPENVERSE_API = env("OPENVERSE_API_BASE", "https://api.openverse.org").rstrip("/")
+TOKEN_URL = f"{OPENVERSE_API}/v1/auth_tokens/token/"
+AUDIO_URL = f"{OPENVERSE_API}/v1/audio/"
 
 UA = "ShortsAuto/1.0 (+https://example.local) Python-requests"
 TOKEN_CACHE = Path.home() / ".openverse_token.json"
+_TOKEN = {}  # token vigente en memoria (evita leer el json en cada request)
+_TOKEN_LOCK = threading.Lock()
+MUSIC_QUERIES = ("synthwave", "80s electronic")
+MUSIC_OFFLINE = env("MUSIC_OFFLINE", "0") == "1"  # sólo catálogo local
 
 # ---------------------------
 # OAuth2 Client Credentials
 # ---------------------------
 
 def openverse_auth_token():
-    global OPENVERSE_TOKEN
-    if OPENVERSE_TOKEN:  # si ya tenemos token en memoria, usarlo
-        return OPENVERSE_TOKEN
-    r = requests.post(
-        "https://api.openverse.org/v1/auth_tokens/token/",
-        headers={"Content-Type": "application/x-www-form-urlencoded"},
-        data={
-            "grant_type": "client_credentials",
-            "client_id": OPENVERSE_CLIENT_ID,
-            "client_secret": OPENVERSE_CLIENT_SECRET,
-        },
-        timeout=20,
-    )
-    r.raise_for_status()
-    OPENVERSE_TOKEN = r.json()["access_token"]
-    print(F"[openverse] TOKEN {OPENVERSE_TOKEN}")
-    return OPENVERSE_TOKEN
+    # antes usaba un global OPENVERSE_TOKEN que nunca se inicializaba
+    return get_openverse_token()
 
 
 def openverse_search_synthwave(q="synthwave", page_size=30, sources="jamendo"):
-    token = openverse_auth_token()
     params = {
         "q": q,
         "license_type": "commercial",                  # sólo licencias aptas p/uso comercial
@@ -50,13 +40,8 @@ def openverse_search_synthwave(q="synthwave", page_size=30, sources="jamendo"):
         "page_size": page_size,
         "fields": "title,creator,license,url,duration,foreign_landing_url,source",
     }
-    print("[INFO][openverse] GET https://api.openverse.org/v1/audio/", "params=", params)
-    r = requests.get(
-        "https://api.openverse.org/v1/audio/",
-        headers={"Authorization": f"Bearer {token}"},
-        params=params,
-        timeout=20,
-    )
+    print("[INFO][openverse] GET", AUDIO_URL, "params=", params)
+    r = net.get(AUDIO_URL, headers=ov_headers(), params=params, timeout=20)
     r.raise_for_status()
     data = r.json()
     results = data.get("results", []) or []
@@ -85,7 +70,7 @@ def pick_and_download_openverse(queries=("synthwave","retrowave","outrun","80s e
             url = choice["url"]
             print("[openverse] elegido:", choice.get("title"), "-", choice.get("creator"), url)
             # descargar con stream
-            with requests.get(url, stream=True, timeout=60) as r:
+            with net.get(url, stream=True, timeout=60) as r:
                 r.raise_for_status()
                 with open(out, "wb") as f:
                     for chunk in r.iter_content(1<<20):
@@ -105,14 +90,36 @@ def pick_and_download_openverse(queries=("synthwave","retrowave","outrun","80s e
             last_err = e
     raise last_err or RuntimeError("No se pudo descargar música desde Openverse")
 
+def music_loudness(path, music_db=-30):
+    """
+    Medición de loudnorm del tema (1ª pasada), una sola vez por contenido:
+    se guarda en el catálogo (.cache/music/catalog.sqlite) por sha256 + objetivo.
+    Si no se puede medir devuelve None (loudnorm dinámico de una pasada).
+    """
+    from src.music_catalog import track_sha, get_loudness, set_loudness
+    try:
+        digest = track_sha(path)
+        target = loudnorm_target(music_db)
+        measured = get_loudness(digest, target)
+        if measured is None:
+            measured = measure_loudness(path, music_db)
+            set_loudness(digest, target, measured)
+            print(f"[music] loudness medida: {measured['input_i']:.1f} LUFS")
+        return measured
+    except Exception as e:
+        print("[music] no se pudo medir loudness:", e)
+        return None
+
+
 def mix_music_into_video(video_in="tmp_base.mp4", music="music.mp3", out="short_with_music.mp4",
                          music_db=-30, ducking_db=-5):
     """
     - Normaliza música a ~-18 LUFS y la baja unos dB (ducking simple)
     - Mantiene el audio original (voz) del video.
     """
-    # baja volumen de música
-    vfilt = f"[1:a]loudnorm=I={music_db}:TP=-1.5:LRA=11:print_format=summary,volume={ducking_db}dB[bg]"
+    # baja volumen de música (2ª pasada lineal con la medición cacheada)
+    vfilt = music_filter("1:a", "bg", music_db, ducking_db,
+                         measured=music_loudness(music, music_db))
     # mezcla voz (0:a) + bg -> outa
     # usa amix con pesos (voz 1.0, bg 0.6 por ejemplo)
     cmd = (
@@ -127,7 +134,12 @@ def mix_music_into_video(video_in="tmp_base.mp4", music="music.mp3", out="short_
 # //////////////////////////
 
 def _save_token(tok: dict):
-    TOKEN_CACHE.write_text(json.dumps(tok, ensure_ascii=False, indent=2), encoding="utf-8")
+    from src.cache import write_atomic
+    write_atomic(TOKEN_CACHE, json.dumps(tok, ensure_ascii=False, indent=2))
+    try:
+        os.chmod(TOKEN_CACHE, 0o600)  # es una credencial
+    except OSError:
+        pass
 
 def _load_token():
     if TOKEN_CACHE.exists():
@@ -138,15 +150,16 @@ def _load_token():
     return None
 
 def _request_new_token():
-    if not OPENVERSE_CLIENT_ID or not OPENVERSE_CLIENT_SECRET:
+    client_id, client_secret = env("OPENVERSE_CLIENT_ID"), env("OPENVERSE_CLIENT_SECRET")
+    if not client_id or not client_secret:
         raise RuntimeError("Faltan OPENVERSE_CLIENT_ID / OPENVERSE_CLIENT_SECRET")
     headers = {"Content-Type": "application/x-www-form-urlencoded", "User-Agent": UA}
     data = {
         "grant_type": "client_credentials",
-        "client_id": OPENVERSE_CLIENT_ID,
-        "client_secret": OPENVERSE_CLIENT_SECRET,
+        "client_id": client_id,
+        "client_secret": client_secret,
     }
-    r = requests.post(TOKEN_URL, headers=headers, data=data, timeout=20)
+    r = net.post(TOKEN_URL, headers=headers, data=data, timeout=20)
     r.raise_for_status()
     resp = r.json()
     # guardamos cuándo expira (epoch segundos)
@@ -154,14 +167,28 @@ def _request_new_token():
     resp["_obtained_at"] = now
     resp["_expires_at"] = now + int(resp.get("expires_in", 0)) - 60  # 60s de margen
     _save_token(resp)
+    _TOKEN.clear()
+    _TOKEN.update(resp)
     return resp
 
+def _token_valid(tok):
+    return bool(tok) and int(time.time()) < int(tok.get("_expires_at", 0))
+
 def get_openverse_token():
-    tok = _load_token()
-    now = int(time.time())
-    if not tok or now >= int(tok.get("_expires_at", 0)):
-        tok = _request_new_token()
-    return tok["access_token"]
+    """
+    Token OAuth2 reusado: memoria -> ~/.openverse_token.json -> pedir uno nuevo.
+    Lock en memoria y en disco: hilos o procesos en paralelo no piden cada uno el suyo.
+    """
+    if _token_valid(_TOKEN):
+        return _TOKEN["access_token"]
+    from src.cache import file_lock
+    with _TOKEN_LOCK, file_lock(f"{TOKEN_CACHE}.lock"):
+        tok = _load_token()
+        if not _token_valid(tok):
+            tok = _request_new_token()
+        _TOKEN.clear()
+        _TOKEN.update(tok)
+        return tok["access_token"]
 
 def ov_headers():
     token = get_openverse_token()
@@ -189,21 +216,95 @@ def openverse_search_audio(
         "page_size": page_size,
         "fields": fields,
     }
-    last = None
-    for _ in range(retries + 1):
-        try:
-            print("[openverse] GET", AUDIO_URL, "params=", params)
-            r = requests.get(AUDIO_URL, headers=ov_headers(), params=params, timeout=20)
-            if r.status_code == 401:
-                # token pudo expirar “antes de tiempo”: forzamos refresh
+    # 429/5xx/timeouts los reintenta net; acá sólo el 401 (token vencido)
+    for attempt in range(retries + 1):
+        print("[openverse] GET", AUDIO_URL, "params=", params)
+        r = net.get(AUDIO_URL, headers=ov_headers(), params=params, timeout=20)
+        if r.status_code == 401 and attempt < retries:
+            # token pudo expirar “antes de tiempo”: forzamos refresh
+            with _TOKEN_LOCK:
                 _request_new_token()
-                continue
-            r.raise_for_status()
-            return r.json().get("results", [])
-        except Exception as e:
-            last = e
-            time.sleep(0.8)
-    raise last or RuntimeError("Openverse search failed")
+            continue
+        r.raise_for_status()
+        return r.json().get("results", [])
+
+def pick_candidates(results, min_sec, max_sec):
+    """Arma [(item, url)] usando alt_files/url y duración en ms."""
+    candidates = []
+    for it in results:
+        dur_ms = it.get("duration") or 0
+        dur_s = dur_ms / 1000.0
+        if not (min_sec <= dur_s <= max_sec):
+            continue
+
+        urls = []
+        alts = it.get("alt_files") or []
+        if alts:
+            # ordenar variantes por bitrate/sample/filesize (desc)
+            alts_sorted = sorted(
+                [a for a in alts if a.get("url")],
+                key=lambda a: (
+                    (a.get("bit_rate") or 0),
+                    (a.get("sample_rate") or 0),
+                    (a.get("filesize") or 0),
+                ),
+                reverse=True,
+            )
+            urls.extend([a["url"] for a in alts_sorted])
+
+        if it.get("url"):
+            urls.append(it["url"])
+
+        # elegir la primera “reproducible” (MP3 / mp32 / genérica de audio)
+        chosen = None
+        for u in urls:
+            ul = u.lower()
+            if (".mp3" in ul) or ("format=mp3" in ul) or ("format=mp32" in ul) or ("/audio/" in ul):
+                chosen = u
+                break
+        if not chosen and urls:
+            chosen = urls[0]  # último recurso
+
+        if chosen:
+            candidates.append((it, chosen))
+    return candidates
+
+
+def track_meta(meta, url, q):
+    """Metadatos útiles para atribución (lo que se guarda en music.json)."""
+    return {
+        "id": meta.get("id"),
+        "title": meta.get("title"),
+        "creator": meta.get("creator"),
+        "license": meta.get("license"),
+        "license_url": meta.get("license_url"),
+        "source": meta.get("source"),
+        "provider": meta.get("provider"),
+        "landing": meta.get("foreign_landing_url"),
+        "detail_url": meta.get("detail_url"),
+        "duration_ms": meta.get("duration"),
+        "picked_url": url,
+        "query": q,
+    }
+
+
+def download_audio(url, out):
+    with net.get(url, headers={"User-Agent": UA}, stream=True, timeout=60) as resp:
+        resp.raise_for_status()
+        with open(out, "wb") as f:
+            for chunk in resp.iter_content(1 << 20):
+                if chunk:
+                    f.write(chunk)
+                    annotate(bytes=len(chunk))
+    return out
+
+
+def write_music_meta(out, meta):
+    Path(out).with_suffix(".json").write_text(
+        json.dumps(meta, ensure_ascii=False, indent=2),
+        encoding="utf-8"
+    )
+
 
 def pick_and_download_openverse(
     q_list=None,
@@ -217,62 +318,20 @@ def pick_and_download_openverse(
     descarga el mejor candidato y devuelve (ruta_mp3, metadatos_dict).
     Requiere que `openverse_search_audio(q=...)` exista y devuelva el JSON
     con "results" (cada item con duration en ms, url y alt_files).
+    El tema descargado queda también en el catálogo local (src/music_catalog.py).
     """
 
 
-    q_list = q_list or [
-        "synthwave",
-        "80s electronic",
-    ]
+    import requests
+    q_list = list(q_list or MUSIC_QUERIES)
     random.shuffle(q_list)
 
-    def _pick_candidates(results, min_sec, max_sec):
-        """Arma [(item, url)] usando alt_files/url y duración en ms."""
-        candidates = []
-        for it in results:
-            dur_ms = it.get("duration") or 0
-            dur_s = dur_ms / 1000.0
-            if not (min_sec <= dur_s <= max_sec):
-                continue
-
-            urls = []
-            alts = it.get("alt_files") or []
-            if alts:
-                # ordenar variantes por bitrate/sample/filesize (desc)
-                alts_sorted = sorted(
-                    [a for a in alts if a.get("url")],
-                    key=lambda a: (
-                        (a.get("bit_rate") or 0),
-                        (a.get("sample_rate") or 0),
-                        (a.get("filesize") or 0),
-                    ),
-                    reverse=True,
-                )
-                urls.extend([a["url"] for a in alts_sorted])
-
-            if it.get("url"):
-                urls.append(it["url"])
-
-            # elegir la primera “reproducible” (MP3 / mp32 / genérica de audio)
-            chosen = None
-            for u in urls:
-                ul = u.lower()
-                if (".mp3" in ul) or ("format=mp3" in ul) or ("format=mp32" in ul) or ("/audio/" in ul):
-                    chosen = u
-                    break
-            if not chosen and urls:
-                chosen = urls[0]  # último recurso
-
-            if chosen:
-                candidates.append((it, chosen))
-        return candidates
-
     last_err = None
     for q in q_list:
         try:
             # Debe devolver dict con clave "results"
             data = openverse_search_audio(q=q)
-            candidates = _pick_candidates(data, min_dur, max_dur)
+            candidates = pick_candidates(data, min_dur, max_dur)
 
             # fallback: si no hubo candidatos por duración/alt_files, tomar el primero con url
             if not candidates:
@@ -289,31 +348,17 @@ def pick_and_download_openverse(
             creator = meta.get("creator")
             print(f"[openverse] elegido: {title} – {creator} :: {url}")
 
-            with requests.get(url, headers={"User-Agent": UA}, stream=True, timeout=60) as resp:
-                resp.raise_for_status()
-                with open(out, "wb") as f:
-                    for chunk in resp.iter_content(1 << 20):
-                        if chunk:
-                            f.write(chunk)
+            download_audio(url, out)
 
             # guarda metadatos útiles para atribución
-            meta_out = {
-                "title": meta.get("title"),
-                "creator": meta.get("creator"),
-                "license": meta.get("license"),
-                "license_url": meta.get("license_url"),
-                "source": meta.get("source"),
-                "provider": meta.get("provider"),
-                "landing": meta.get("foreign_landing_url"),
-                "detail_url": meta.get("detail_url"),
-                "duration_ms": meta.get("duration"),
-                "picked_url": url,
-                "query": q,
-            }
-            Path(out).with_suffix(".json").write_text(
-                json.dumps(meta_out, ensure_ascii=False, indent=2),
-                encoding="utf-8"
-            )
+            meta_out = track_meta(meta, url, q)
+            try:
+                from src.music_catalog import add_track
+                add_track(meta_out, out)
+            except Exception as e:
+                print("[music] no se pudo guardar en el catálogo:", e)
+            meta_out["loudness"] = music_loudness(out)
+            write_music_meta(out, meta_out)
             return out, meta_out
 
         except requests.HTTPError as e:
@@ -324,3 +369,26 @@ def pick_and_download_openverse(
             print("[openverse] error:", e)
 
     raise last_err or RuntimeError("No se pudo descargar música desde Openverse")
+
+
+def pick_music(out="music.mp3", q_list=None, min_dur=20, max_dur=90):
+    """
+    Música para un render: primero el catálogo local (sin red, el tema menos
+    usado últimamente); si no hay nada que sirva, Openverse en vivo (y el
+    tema queda en el catálogo). Con MUSIC_OFFLINE=1 nunca sale a la red.
+    Devuelve (ruta_audio, metadatos) igual que pick_and_download_openverse.
+    """
+    from src.music_catalog import pick_from_catalog
+    picked = pick_from_catalog(q_list or MUSIC_QUERIES, min_dur, max_dur)
+    if not picked and MUSIC_OFFLINE:
+        picked = pick_from_catalog((), min_dur, max_dur, any_tag=True)
+    if picked:
+        path, meta = picked
+        meta["loudness"] = music_loudness(path)
+        write_music_meta(out, meta)
+        print(f"[music] catálogo local: {meta.get('title')} – {meta.get('creator')}")
+        return path, meta
+    if MUSIC_OFFLINE:
+        raise RuntimeError("MUSIC_OFFLINE=1 y el catálogo no tiene temas que sirvan "
+                           "(llenarlo con build_short.py --refresh-music)")
+    return pick_and_download_openverse(q_list, out=out, min_dur=min_dur, max_dur=max_dur)
@@ -0,0 +1,256 @@
+import os
+import time
+import random
+import shutil
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from src.env import env
+from src.cache import CACHE_ROOT, file_sha256
+from src.render import LOUDNORM_KEYS
+
+# --- CONFIG ---
+MUSIC_DIR = CACHE_ROOT / "music"
+CATALOG_DB = MUSIC_DIR / "catalog.sqlite"
+MUSIC_FILES = MUSIC_DIR / "files"
+RECENT_POOL = 5  # se sortea entre los N temas menos usados últimamente
+REFRESH_PER_QUERY = int(env("MUSIC_REFRESH_PER_QUERY", "8"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id TEXT PRIMARY KEY,
+    title TEXT, creator TEXT,
+    license TEXT, license_url TEXT,
+    source TEXT, provider TEXT, landing TEXT, detail_url TEXT,
+    url TEXT,
+    duration_s REAL,
+    file TEXT NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    added_at INTEGER,
+    last_used_at INTEGER DEFAULT 0,
+    use_count INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS track_tags (
+    track_id TEXT NOT NULL REFERENCES tracks(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (track_id, tag)
+);
+CREATE TABLE IF NOT EXISTS track_loudness (
+    sha256 TEXT NOT NULL,
+    target TEXT NOT NULL,
+    input_i REAL, input_tp REAL, input_lra REAL, input_thresh REAL, target_offset REAL,
+    measured_at INTEGER,
+    PRIMARY KEY (sha256, target)
+);
+CREATE INDEX IF NOT EXISTS idx_tags_tag ON track_tags(tag);
+CREATE INDEX IF NOT EXISTS idx_tracks_duration ON tracks(duration_s);
+CREATE INDEX IF NOT EXISTS idx_tracks_last_used ON tracks(last_used_at);
+"""
+
+
+def norm_tag(tag):
+    return " ".join(str(tag).lower().split())
+
+
+def connect(db=None):
+    """Conexión al catálogo (WAL: el daemon/batch lo leen desde varios hilos/procesos)."""
+    db = Path(db or CATALOG_DB)
+    db.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _track_id(meta):
+    # Openverse no siempre devuelve el id (depende de `fields`): la URL sirve igual
+    return str(meta.get("id") or meta.get("picked_url"))
+
+
+def _row_meta(row):
+    """Fila -> el mismo dict que escribe pick_and_download_openverse (music.json)."""
+    return {
+        "id": row["id"], "title": row["title"], "creator": row["creator"],
+        "license": row["license"], "license_url": row["license_url"],
+        "source": row["source"], "provider": row["provider"],
+        "landing": row["landing"], "detail_url": row["detail_url"],
+        "duration_ms": int(row["duration_s"] * 1000) if row["duration_s"] else None,
+        "picked_url": row["url"], "query": None, "catalog": True,
+        "sha256": row["sha256"],
+    }
+
+
+def add_track(meta, path, tags=(), conn=None, suffix=None):
+    """
+    Copia `path` a .cache/music/files/<sha256> y lo registra con su licencia,
+    duración y tags (la query con que se encontró + tags de Openverse).
+    """
+    digest = file_sha256(path)
+    dest = MUSIC_FILES / f"{digest}{suffix or Path(path).suffix or '.mp3'}"
+    if not dest.exists():
+        MUSIC_FILES.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, dest)
+    tid = _track_id(meta)
+    all_tags = {norm_tag(t) for t in (*tags, meta.get("query")) if t}
+    own = conn is None
+    conn = conn or connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO tracks (id, title, creator, license, license_url, source, provider,"
+                " landing, detail_url, url, duration_s, file, size, sha256, added_at)"
+                " VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+                " ON CONFLICT(id) DO UPDATE SET file=excluded.file, size=excluded.size,"
+                " sha256=excluded.sha256",
+                (tid, meta.get("title"), meta.get("creator"), meta.get("license"),
+                 meta.get("license_url"), meta.get("source"), meta.get("provider"),
+                 meta.get("landing"), meta.get("detail_url"), meta.get("picked_url"),
+                 (meta.get("duration_ms") or 0) / 1000.0, dest.name, dest.stat().st_size,
+                 digest, int(time.time())))
+            conn.executemany("INSERT OR IGNORE INTO track_tags (track_id, tag) VALUES (?, ?)",
+                             [(tid, t) for t in all_tags])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        if own:
+            conn.close()
+    return str(dest)
+
+
+def pick_from_catalog(tags, min_dur, max_dur, any_tag=False):
+    """
+    Tema local con duración en [min_dur, max_dur] y alguno de `tags`, entre los
+    menos usados últimamente (consulta por índices, sin red).
+    - lo marca como usado en la misma transacción (dos renders a la vez no
+      se llevan el mismo tema)
+    - any_tag: ignora los tags (mejor cualquier tema que ninguno)
+    Devuelve (ruta, metadatos) o None.
+    """
+    if not CATALOG_DB.exists():
+        return None
+    tags = [norm_tag(t) for t in tags or ()]
+    if not tags and not any_tag:
+        return None  # ningún tag pedido: nada que coincida (any_tag=True para cualquiera)
+    sql = "SELECT * FROM tracks t WHERE t.duration_s BETWEEN ? AND ?"
+    params = [min_dur, max_dur]
+    if not any_tag:
+        sql += (" AND EXISTS (SELECT 1 FROM track_tags g WHERE g.track_id = t.id"
+                f" AND g.tag IN ({','.join('?' * len(tags))}))")
+        params += tags
+    sql += " ORDER BY t.last_used_at ASC LIMIT ?"
+
+    with closing(connect()) as conn:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(sql, params + [RECENT_POOL]).fetchall()
+                if not rows:
+                    conn.execute("COMMIT")
+                    return None
+                row = random.choice(rows)
+                path = MUSIC_FILES / row["file"]
+                if not path.exists():
+                    # archivo borrado a mano: se olvida y se prueba otro
+                    conn.execute("DELETE FROM tracks WHERE id = ?", (row["id"],))
+                    conn.execute("COMMIT")
+                    continue
+                conn.execute("UPDATE tracks SET last_used_at = ?, use_count = use_count + 1"
+                             " WHERE id = ?", (int(time.time()), row["id"]))
+                conn.execute("COMMIT")
+                return str(path), _row_meta(row)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+
+def track_sha(path):
+    """sha256 del audio (los del catálogo ya lo llevan en el nombre)."""
+    path = Path(path)
+    if path.parent == MUSIC_FILES:
+        return path.stem
+    return file_sha256(path)
+
+
+def get_loudness(sha256, target):
+    """Medición de loudnorm guardada para ese contenido y objetivo (o None)."""
+    if not CATALOG_DB.exists():
+        return None
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT * FROM track_loudness WHERE sha256 = ? AND target = ?",
+                           (sha256, target)).fetchone()
+    return {k: row[k] for k in LOUDNORM_KEYS} if row else None
+
+
+def set_loudness(sha256, target, measured):
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO track_loudness (sha256, target, input_i, input_tp, input_lra,"
+            " input_thresh, target_offset, measured_at) VALUES (?,?,?,?,?,?,?,?)",
+            (sha256, target, *(measured[k] for k in LOUDNORM_KEYS), int(time.time())))
+
+
+def refresh_catalog(queries, min_dur=15, max_dur=300, per_query=REFRESH_PER_QUERY):
+    """
+    Llena el catálogo desde Openverse (fuera del render: cron, a mano, etc.).
+    Por query baja hasta `per_query` temas nuevos. Devuelve cuántos agregó.
+    """
+    from src.music import (openverse_search_audio, pick_candidates, track_meta,
+                           download_audio, music_loudness)
+
+    added = 0
+    MUSIC_FILES.mkdir(parents=True, exist_ok=True)
+    with closing(connect()) as conn:
+        for q in queries:
+            try:
+                results = openverse_search_audio(q=q)
+            except Exception as e:
+                print(f"[music] búsqueda '{q}' falló:", e)
+                continue
+            n = 0
+            for item, url in pick_candidates(results, min_dur, max_dur):
+                if n >= per_query:
+                    break
+                meta = track_meta(item, url, q)
+                tid = _track_id(meta)
+                if conn.execute("SELECT 1 FROM tracks WHERE id = ?", (tid,)).fetchone():
+                    # ya está: sólo se suma el tag de esta query
+                    conn.execute("INSERT OR IGNORE INTO track_tags (track_id, tag) VALUES (?, ?)",
+                                 (tid, norm_tag(q)))
+                    continue
+                part = MUSIC_FILES / f".{os.getpid()}.part"
+                try:
+                    download_audio(url, str(part))
+                    tags = [t.get("name") for t in item.get("tags") or [] if isinstance(t, dict)]
+                    path = add_track(meta, part, tags=tags, conn=conn, suffix=".mp3")
+                except Exception as e:
+                    print(f"[music] no se pudo bajar {url}:", e)
+                    continue
+                finally:
+                    if part.exists():
+                        part.unlink()
+                n += 1
+                added += 1
+                print(f"[music] + {meta.get('title')} – {meta.get('creator')} ({q})")
+                music_loudness(path)  # se mide ahora y no en el primer render que lo use
+    return added
+
+
+def catalog_report():
+    if not CATALOG_DB.exists():
+        print("[music] catálogo vacío")
+        return {"tracks": 0}
+    with closing(connect()) as conn:
+        n, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tracks").fetchone()
+        tags = conn.execute("SELECT tag, COUNT(*) FROM track_tags GROUP BY tag ORDER BY 2 DESC").fetchall()
+    print(f"[music] catálogo: {n} temas, {size / 1e6:.1f} MB")
+    for tag, c in tags:
+        print(f"[music]   {tag:<24} {c}")
+    return {"tracks": n, "bytes": size, "tags": dict(tags)}
@@ -0,0 +1,86 @@
+import os
+import time
+import random
+import threading
+from src.env import env
+
+# --- CONFIG ---
+HTTP_POOL_SIZE = int(env("HTTP_POOL_SIZE", "16"))  # conexiones keep-alive por host
+HTTP_RETRIES = int(env("HTTP_RETRIES", "3"))       # reintentos ante 429/5xx/timeouts
+HTTP_BACKOFF_S = 0.5    # base del backoff exponencial
+HTTP_BACKOFF_MAX_S = 20.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_LOCK = threading.Lock()
+_SESSIONS = {}  # pid -> Session (después de un fork no se comparten sockets)
+
+
+def session():
+    """
+    requests.Session compartida por el proceso: un pool keep-alive por host,
+    así cada llamada no paga DNS + TCP + TLS de nuevo.
+    """
+    pid = os.getpid()
+    s = _SESSIONS.get(pid)
+    if s is not None:
+        return s
+    with _LOCK:
+        if pid not in _SESSIONS:
+            import requests
+            from requests.adapters import HTTPAdapter
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _SESSIONS.clear()
+            _SESSIONS[pid] = s
+        return _SESSIONS[pid]
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Backoff exponencial con jitter completo (respeta Retry-After si viene)."""
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX_S)
+        except ValueError:
+            pass
+    return random.uniform(0, min(HTTP_BACKOFF_MAX_S, HTTP_BACKOFF_S * 2 ** attempt))
+
+
+def request(method, url, retries=None, retry_status=RETRY_STATUS, timeout=20, **kw):
+    """
+    session().request con la misma política de reintentos para todas las APIs:
+    - errores de conexión y timeouts, y las respuestas en `retry_status`,
+      se reintentan hasta `retries` veces con backoff + jitter
+    - la última respuesta se devuelve tal cual (el que llama hace raise_for_status)
+    """
+    import requests
+    retries = HTTP_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            r = session().request(method, url, timeout=timeout, **kw)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"[http] {type(e).__name__} en {url}, reintento en {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        if r.status_code not in retry_status or attempt >= retries:
+            return r
+        delay = backoff_delay(attempt, r.headers.get("Retry-After"))
+        print(f"[http] {r.status_code} en {url}, reintento en {delay:.1f}s")
+        r.close()  # devuelve la conexión al pool
+        time.sleep(delay)
+
+
+def get(url, **kw):
+    return request("GET", url, **kw)
+
+
+def post(url, **kw):
+    return request("POST", url, **kw)
+
+
+def head(url, **kw):
+    return request("HEAD", url, **kw)
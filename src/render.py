@@ -0,0 +1,373 @@
+import os
+import json
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from src.env import env
+from src.tracing import span, submit
+from src.cache import cached_segment, content_id, SEGMENT_STATS
+from pathlib import Path
+
+# --- CONFIG (formato de salida, compartido con src/video.py) ---
+W, H = 1080, 1920
+FPS = 30
+BITRATE = "6000k"
+A_BITRATE = "192k"
+FADE = 0.1          # fade in/out del video completo (s)
+ZOOM_END = 1.08     # Ken Burns de fotos: 1.00 -> 1.08
+ZOOM_SUPERSAMPLE = 2  # zoompan sobre la foto a 2x: movimiento suave sin jitter
+SCENE_WORKERS = int(env("SCENE_WORKERS", "0"))  # 0 = CPUs/2
+SCENE_THREADS = int(env("SCENE_THREADS", "0"))  # hilos x264 por escena (0 = reparto)
+SEGMENT_VERSION = 2   # subir si cambia cómo se codifica una escena (invalida .cache/segments)
+LOUDNORM_TP = -1.5    # música: true peak máx. (dBTP)
+LOUDNORM_LRA = 11     # música: rango de loudness
+LOUDNORM_KEYS = ("input_i", "input_tp", "input_lra", "input_thresh", "target_offset")
+
+
+def ff_threads():
+    """Hilos de x264 por encode (FFMPEG_THREADS; vacío = los que elija ffmpeg)."""
+    n = env("FFMPEG_THREADS")
+    return int(n) if n else None
+
+
+def run_ff(args):
+    """Corre ffmpeg/ffprobe con lista de argumentos (sin shell)."""
+    print(">>", " ".join(str(a) for a in args))
+    return subprocess.run([str(a) for a in args], check=True)
+
+
+def probe_media(path):
+    """
+    ffprobe del primer stream de video/imagen.
+    Devuelve {duration, width, height, fps}; lanza excepción si no se puede leer.
+    """
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,avg_frame_rate:format=duration",
+        "-of", "json", str(path),
+    ]
+    r = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    data = json.loads(r.stdout or "{}")
+    streams = data.get("streams") or []
+    if not streams:
+        raise RuntimeError(f"sin stream de video: {path}")
+    st = streams[0]
+    num, _, den = (st.get("avg_frame_rate") or "0/1").partition("/")
+    fps = float(num) / float(den) if den and float(den) else 0.0
+    try:
+        duration = float((data.get("format") or {}).get("duration") or 0.0)
+    except ValueError:
+        duration = 0.0
+    return {"duration": duration, "width": int(st.get("width") or 0),
+            "height": int(st.get("height") or 0), "fps": fps}
+
+
+def ff_escape_path(path):
+    # En filtros de FFmpeg, ':' separa opciones, así que hay que escaparlo como '\:'
+    # También escapamos comillas simples por seguridad.
+    return Path(path).resolve().as_posix().replace(":", r"\:").replace("'", r"\'")
+
+
+def subtitles_filter(subs_path, force_style=None):
+    """Filtro `subtitles=` con la ruta escapada (y force_style opcional)."""
+    vf = f"subtitles='{ff_escape_path(subs_path)}'"
+    if force_style:
+        vf += f":force_style='{force_style}'"
+    return vf
+
+
+def fit_filter():
+    # escala hasta cubrir 1080x1920 y recorta al centro (igual que fit_vertical)
+    return (f"scale={W}:{H}:force_original_aspect_ratio=increase,"
+            f"crop={W}:{H},setsar=1")
+
+
+def photo_filter(dur, zoom_end=ZOOM_END, supersample=ZOOM_SUPERSAMPLE):
+    """
+    Ken Burns centrado 1.00 -> zoom_end con zoompan, a partir de UN frame:
+    la foto se escala una sola vez (a `supersample`x la salida, para que el
+    paso de zoom no salte de a píxel entero) y zoompan genera los n frames
+    con el zoom ya calculado por frame.
+    """
+    n = max(1, round(dur * FPS))
+    z = f"1+{zoom_end - 1.0:.4f}*on/{n}"
+    sw, sh = W * supersample, H * supersample
+    return (f"scale={sw}:{sh}:force_original_aspect_ratio=increase,crop={sw}:{sh},setsar=1,"
+            f"zoompan=z='{z}':d={n}:"
+            f"x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':s={W}x{H}:fps={FPS}")
+
+
+def scene_input_args(asset):
+    """Argumentos de entrada de ffmpeg para un asset de resolve_scene_assets."""
+    dur = f"{asset['dur']:.3f}"
+    if asset["kind"] == "video":
+        return ["-stream_loop", "-1", "-t", dur, "-i", asset["path"]]
+    if asset["kind"] == "photo":
+        return ["-i", asset["path"]]  # un solo frame: zoompan genera la escena
+    return ["-f", "lavfi", "-t", dur, "-i", f"color=c=black:s={W}x{H}:r={FPS}"]
+
+
+def scene_filter(asset, label_in, label_out):
+    """Cadena de filtros que normaliza una escena a 1080x1920@30 yuv420p."""
+    dur = asset["dur"]
+    if asset["kind"] == "video":
+        chain = f"{fit_filter()},fps={FPS}"
+    elif asset["kind"] == "photo":
+        chain = photo_filter(dur, asset.get("zoom_end", ZOOM_END))
+    else:
+        chain = "setsar=1"
+    return (f"[{label_in}]{chain},trim=duration={dur:.3f},setpts=PTS-STARTPTS,"
+            f"format=yuv420p[{label_out}]")
+
+
+def loudnorm_target(music_db=-30):
+    return f"I={music_db}:TP={LOUDNORM_TP}:LRA={LOUDNORM_LRA}"
+
+
+def measure_loudness(path, music_db=-30):
+    """
+    1ª pasada de loudnorm (sólo análisis, sin codificar):
+    {input_i, input_tp, input_lra, input_thresh, target_offset}.
+    """
+    cmd = ["ffmpeg", "-hide_banner", "-nostats", "-i", str(path), "-vn",
+           "-af", f"loudnorm={loudnorm_target(music_db)}:print_format=json", "-f", "null", "-"]
+    r = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    # el JSON es lo último que imprime loudnorm en stderr
+    err = r.stderr
+    data = json.loads(err[err.rindex("{"):err.rindex("}") + 1])
+    return {k: float(data[k]) for k in LOUDNORM_KEYS}
+
+
+def music_filter(label_in, label_out, music_db=-30, ducking_db=-5, measured=None):
+    """
+    Normaliza música y la baja unos dB (mismo criterio que mix_music_into_video).
+    - measured: medición de measure_loudness -> 2ª pasada lineal (más exacta y
+      barata); sin medición, loudnorm dinámico de una pasada
+    """
+    norm = f"loudnorm={loudnorm_target(music_db)}"
+    if measured:
+        norm += (f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+                 f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+                 f":offset={measured['target_offset']}:linear=true")
+    return f"[{label_in}]{norm},volume={ducking_db}dB[{label_out}]"
+
+
+def _x264_args(threads=None):
+    # mismos parámetros en todos los segmentos: el concat demuxer copia sin recodificar
+    args = ["-r", FPS, "-c:v", "libx264", "-b:v", BITRATE, "-pix_fmt", "yuv420p"]
+    threads = threads or ff_threads()
+    if threads:
+        args += ["-threads", threads]
+    return args
+
+
+def cpu_budget():
+    """CPUs usables por este proceso (respeta la afinidad que fija el batch)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def scene_workers(n_scenes, workers=None):
+    """(encoders en paralelo, hilos por encoder) para codificar n_scenes escenas."""
+    budget = ff_threads() or cpu_budget()  # FFMPEG_THREADS = presupuesto total del render
+    workers = workers or SCENE_WORKERS or max(1, budget // 2)
+    workers = max(1, min(workers, n_scenes))
+    threads = SCENE_THREADS or max(1, budget // workers)
+    return workers, threads
+
+
+def encode_scene(asset, out, fade_in=0.0, fade_out=0.0, threads=None, subs=None):
+    """
+    Normaliza UNA escena con ffmpeg (fit 1080x1920@30, loop, trim, zoom de
+    fotos) a un mp4 sin audio con parámetros uniformes.
+    - subs: .ass con los cues de la escena en su tiempo local (se queman acá)
+    """
+    dur = asset["dur"]
+    graph = scene_filter(asset, "0:v", "v")
+    fades = []
+    if fade_in:
+        fades.append(f"fade=t=in:st=0:d={fade_in}")
+    if fade_out:
+        fades.append(f"fade=t=out:st={max(0.0, dur - fade_out):.3f}:d={fade_out}")
+    if subs:
+        fades.append(subtitles_filter(subs))  # después del fade, como el burn del video entero
+    graph += f";[v]{','.join(fades) or 'null'}[vout]"
+    args = ["ffmpeg", "-y", "-loglevel", "error"] + scene_input_args(asset)
+    args += ["-filter_complex", graph, "-map", "[vout]", "-an", "-t", f"{dur:.3f}"]
+    with span("scene_encode", kind=asset["kind"], path=asset["path"], dur=dur):
+        run_ff(args + _x264_args(threads) + [out])
+    return out
+
+
+def concat_scenes(segments, voice, out, list_path, total):
+    """Une los segmentos con el concat demuxer (copia de stream) y agrega la voz."""
+    lines = [f"file '{Path(p).resolve().as_posix()}'" for p in segments]
+    Path(list_path).write_text("\n".join(lines) + "\n", encoding="utf-8")
+    with span("concat", segments=len(segments)):
+        run_ff(["ffmpeg", "-y", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", list_path, "-i", voice,
+                "-map", "0:v", "-map", "1:a", "-c:v", "copy", "-c:a", "aac", "-b:a", A_BITRATE,
+                "-af", "apad", "-t", f"{total:.3f}", "-movflags", "+faststart", out])
+    return out
+
+
+def scene_key(asset, fade_in=0.0, fade_out=0.0, cues=None, sub_style=None):
+    """
+    Clave de un segmento codificado: contenido del asset + duración (en
+    frames) + fades + subtítulos quemados (cues locales + estilo) + parámetros
+    de render. Sin subtítulos el texto de la escena no entra: no cambia los píxeles.
+    """
+    spec = {
+        "cues": [list(c) for c in cues] if cues else None, "sub_style": sub_style if cues else None,
+        "v": SEGMENT_VERSION, "kind": asset["kind"],
+        "src": asset.get("sha256") or (content_id(asset["path"]) if asset.get("path") else None),
+        "frames": round(asset["dur"] * FPS), "fade_in": fade_in, "fade_out": fade_out,
+        "zoom_end": asset.get("zoom_end", ZOOM_END), "supersample": ZOOM_SUPERSAMPLE,
+        "size": [W, H], "fps": FPS, "bitrate": BITRATE,
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+def snap_to_frames(assets):
+    """
+    Duración de cada escena en frames enteros, redondeando la de cada una (no
+    los bordes acumulados): editar una frase no le cambia el largo a las
+    demás, y una escena sin cambios da exactamente el mismo segmento.
+    El desfase acumulado lo absorbe la última escena (el total queda a medio
+    frame del original).
+    """
+    if not assets:
+        return []
+    frames = [max(1, round(a["dur"] * FPS)) for a in assets]
+    total = round(sum(a["dur"] for a in assets) * FPS)
+    frames[-1] = max(1, total - sum(frames[:-1]))
+    return [dict(a, dur=n / FPS) for a, n in zip(assets, frames)]
+
+
+def scene_cues(cues, assets, snapped):
+    """
+    Cues (src.subtitles.Cues, tiempos del video) repartidos por escena y en
+    tiempo local: [[(start, end, text)], ...]. El origen de cada escena es la
+    suma de las duraciones sin ajustar, así el redondeo de otra escena no
+    mueve los tiempos (ni la clave) de ésta; un cue que cruza un borde se parte.
+    """
+    out, t0 = [], 0.0
+    for a, s in zip(assets, snapped):
+        t1 = t0 + a["dur"]
+        mine = []
+        for st, en, text in cues:
+            st, en = round(max(0.0, st - t0), 3), round(min(s["dur"], en - t0, t1 - t0), 3)
+            if text and en > st:
+                mine.append((st, en, text))
+        out.append(mine)
+        t0 = t1
+    return out
+
+
+def compose_scenes_ffmpeg(assets, voice, out="tmp_base.mp4", tmp_dir="tmp_broll", use_cache=True,
+                          workers=None, cues=None, sub_style=None):
+    """
+    Equivalente ffmpeg de build_video_from_segments (moviepy): cada escena se
+    normaliza a su propio segmento y se concatenan sin recodificar.
+    El fade del video completo va en la primera y la última escena.
+    - use_cache: los segmentos se guardan en .cache/segments por scene_key;
+      al re-renderizar sólo se codifican las escenas que cambiaron
+    - workers: escenas codificadas a la vez (cada una es un proceso ffmpeg
+      con su parte de los hilos; default SCENE_WORKERS o CPUs/2)
+    - cues: subtítulos (src.subtitles.Cues) quemados escena por escena con
+      sub_style; entran en la clave, así corregir una frase recodifica sólo
+      sus escenas y el resto no pasa por x264 (no hace falta un burn final)
+    La voz se agrega una sola vez, en el concat.
+    """
+    from src.subtitles import Cues
+    seg_dir = Path(tmp_dir) / "scenes"
+    seg_dir.mkdir(parents=True, exist_ok=True)
+    raw, assets = assets, snap_to_frames(assets)
+    local = scene_cues(cues, raw, assets) if cues is not None else [None] * len(assets)
+    before = dict(SEGMENT_STATS)
+    workers, threads = scene_workers(len(assets), workers)
+
+    def one(k):
+        a = assets[k]
+        fade_in = FADE if k == 0 else 0.0
+        fade_out = FADE if k == len(assets) - 1 else 0.0
+
+        def build(path):
+            subs = None
+            if local[k]:
+                sc = Cues()
+                for c in local[k]:
+                    sc.append(*c)
+                subs = sc.to_ass(str(seg_dir / f"subs{k:03d}.ass"), **(sub_style or {}))
+            return encode_scene(a, path, fade_in=fade_in, fade_out=fade_out, threads=threads,
+                                subs=subs)
+
+        with span("scene", index=k, kind=a["kind"]):
+            if use_cache:
+                return cached_segment(scene_key(a, fade_in, fade_out, local[k], sub_style), build)
+            return build(str(seg_dir / f"scene{k:03d}.mp4"))
+
+    print(f"[render] {len(assets)} escenas: {workers} encoders x {threads} hilos")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scene") as pool:
+        futs = [submit(pool, one, k) for k in range(len(assets))]
+        # el orden de `segments` es el de las escenas, terminen cuando terminen
+        segments = [f.result() for f in futs]
+    if use_cache:
+        hit = SEGMENT_STATS["hit"] - before["hit"]
+        print(f"[cache] escenas reusadas {hit}/{len(assets)}")
+    total = sum(a["dur"] for a in assets)
+    return concat_scenes(segments, voice, out, str(seg_dir / "concat.txt"), total)
+
+
+def render_single_pass(assets, voice, music, subs, out="short_final.mp4",
+                       force_style=None, music_db=-30, ducking_db=-5):
+    """
+    Render final en UNA sola codificación: escenas + voz + música + subtítulos.
+    Reemplaza tmp_base.mp4 -> tmp_with_music.mp4 -> burn_subs (3 pasadas x264).
+    - voz = entrada 0, música = entrada 1, escenas = entradas 2..N
+    - duraciones ajustadas a frames enteros, igual que compose_scenes_ffmpeg
+    """
+    out = str(Path(out).with_suffix(".mp4"))
+    assets = snap_to_frames(assets)
+    total = sum(a["dur"] for a in assets)
+
+    args = ["ffmpeg", "-y", "-i", voice]
+    if music:
+        args += ["-i", music]
+    else:
+        # sin música: entrada silenciosa para no cambiar el grafo
+        args += ["-f", "lavfi", "-i", "anullsrc=r=44100:cl=stereo"]
+    for a in assets:
+        args += scene_input_args(a)
+
+    graph = []
+    for k, a in enumerate(assets):
+        graph.append(scene_filter(a, f"{k + 2}:v", f"v{k}"))
+    concat_in = "".join(f"[v{k}]" for k in range(len(assets)))
+    vchain = (f"{concat_in}concat=n={len(assets)}:v=1:a=0,"
+              f"fade=t=in:st=0:d={FADE},fade=t=out:st={max(0.0, total - FADE):.3f}:d={FADE}")
+    if subs:
+        vchain += "," + subtitles_filter(subs, force_style)
+    graph.append(vchain + "[vout]")
+
+    if music:
+        from src.music import music_loudness  # src.music importa este módulo
+        graph.append(music_filter("1:a", "bg", music_db, ducking_db,
+                                  measured=music_loudness(music, music_db)))
+    else:
+        graph.append("[1:a]anull[bg]")
+    graph.append("[0:a]apad[voice]")
+    graph.append("[voice][bg]amix=inputs=2:duration=first:dropout_transition=0,volume=1.0[aout]")
+
+    args += [
+        "-filter_complex", ";".join(graph),
+        "-map", "[vout]", "-map", "[aout]",
+        "-t", f"{total:.3f}", "-r", FPS,
+        "-c:v", "libx264", "-b:v", BITRATE, "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", A_BITRATE,
+    ]
+    if ff_threads():
+        args += ["-threads", ff_threads()]
+    run_ff(args + [out])
+    return out
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import hashlib
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from src.cache import write_atomic
+from src.tracing import span, submit
+
+STAGES_VERSION = 1  # subir si cambia el formato del estado guardado
+
+
+class Stage:
+    """
+    Etapa del pipeline: fn(*salidas de deps) -> salida (JSON: rutas, dicts...).
+    - params: entradas propias que no vienen de otra etapa (hash del audio,
+      opciones); junto con las salidas de las deps forman la clave del cache
+    """
+
+    def __init__(self, name, fn, deps=(), params=None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.params = params or {}
+
+
+def _sha(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False,
+                                     default=str).encode("utf-8")).hexdigest()
+
+
+def _files(obj, out=None):
+    # rutas a archivos existentes dentro de la salida (se validan al reanudar)
+    out = {} if out is None else out
+    if isinstance(obj, dict):
+        for v in obj.values():
+            _files(v, out)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            _files(v, out)
+    elif isinstance(obj, str) and len(obj) < 4096 and os.path.isfile(obj):
+        out[obj] = os.path.getsize(obj)
+    return out
+
+
+def _load_done(state_dir, stage, key):
+    """Salida guardada de una corrida anterior, si la clave coincide y los archivos siguen."""
+    path = state_dir / f"{stage.name}.json"
+    if not path.exists():
+        return None
+    try:
+        rec = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if rec.get("key") != key:
+        return None
+    for f, size in rec.get("files", {}).items():
+        if not os.path.isfile(f) or os.path.getsize(f) != size:
+            return None
+    return rec
+
+
+def critical_path(report):
+    """
+    Cadena de etapas que determinó el tiempo total: desde la que terminó
+    última, se sigue hacia atrás por la dep que terminó más tarde.
+    """
+    if not report:
+        return []
+    name = max(report, key=lambda n: report[n]["end_s"])
+    path = [name]
+    while report[name]["deps"]:
+        name = max(report[name]["deps"], key=lambda n: report[n]["end_s"])
+        path.append(name)
+    return path[::-1]
+
+
+def print_report(report):
+    print(f"[stages] {'etapa':<12} {'inicio':>7} {'fin':>7} {'dur s':>7}")
+    for name, r in sorted(report.items(), key=lambda kv: kv[1]["start_s"]):
+        flag = " (cache)" if r["cached"] else ""
+        print(f"[stages] {name:<12} {r['start_s']:>7.2f} {r['end_s']:>7.2f} {r['dur_s']:>7.2f}{flag}")
+    path = critical_path(report)
+    if path:
+        total = report[path[-1]]["end_s"]
+        print(f"[stages] camino crítico ({total:.2f}s): {' -> '.join(path)}")
+
+
+def run_stages(stages, state_dir=None, workers=None, keep_state=False, after_stage=None):
+    """
+    Corre las etapas respetando dependencias; las independientes en paralelo.
+    - state_dir: cada etapa terminada deja <name>.json con (clave, salida); si
+      la corrida se cae, la siguiente retoma desde ahí (se saltea lo hecho)
+    - al terminar bien se borra el estado (salvo keep_state): una corrida
+      nueva vuelve a elegir música, b-roll, etc.
+    - after_stage(name): se llama cuando termina cada etapa (ya guardada); si
+      lanza, la corrida se corta igual que si la etapa hubiera fallado
+    Devuelve ({name: salida}, reporte por etapa).
+    """
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        missing = [d for d in s.deps if d not in by_name]
+        if missing:
+            raise ValueError(f"etapa {s.name}: deps desconocidas {missing}")
+    state_dir = Path(state_dir) if state_dir else None
+    if state_dir:
+        state_dir.mkdir(parents=True, exist_ok=True)
+
+    outputs, hashes, report = {}, {}, {}
+    t0 = time.perf_counter()
+    pending = list(stages)
+    inflight = {}  # future -> (stage, key, start)
+    error = None
+
+    def finish(stage, key, out, start, cached):
+        outputs[stage.name] = out
+        hashes[stage.name] = _sha({"key": key, "out": out})
+        end = time.perf_counter() - t0
+        report[stage.name] = {"deps": list(stage.deps), "cached": cached,
+                              "start_s": round(start, 3), "end_s": round(end, 3),
+                              "dur_s": round(end - start, 3)}
+
+    def launch():
+        # arranca todo lo que ya tiene sus deps; lo cacheado puede destrabar más
+        progressed = True
+        while progressed:
+            progressed = False
+            for stage in [s for s in pending if all(d in outputs for d in s.deps)]:
+                pending.remove(stage)
+                key = _sha({"v": STAGES_VERSION, "stage": stage.name, "params": stage.params,
+                            "deps": [hashes[d] for d in stage.deps]})
+                start = time.perf_counter() - t0
+                rec = _load_done(state_dir, stage, key) if state_dir else None
+                if rec is not None:
+                    print(f"[stages] {stage.name}: ya hecha en una corrida anterior")
+                    finish(stage, key, rec["out"], start, cached=True)
+                    progressed = True
+                    continue
+                fut = submit(pool, _run_stage, stage, [outputs[d] for d in stage.deps])
+                inflight[fut] = (stage, key, start)
+
+    pool = ThreadPoolExecutor(max_workers=workers or len(stages) or 1)
+    try:
+        while True:
+            if error is None:
+                launch()
+            if not inflight:
+                if pending and error is None:
+                    raise ValueError(f"dependencias circulares: {[s.name for s in pending]}")
+                break
+            done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+            for fut in done:
+                stage, key, start = inflight.pop(fut)
+                try:
+                    out = fut.result()
+                except Exception as e:
+                    # se deja terminar lo que está corriendo (queda guardado) y se relanza
+                    error = error or e
+                    continue
+                finish(stage, key, out, start, cached=False)
+                if state_dir:
+                    write_atomic(state_dir / f"{stage.name}.json", json.dumps(
+                        {"key": key, "out": out, "files": _files(out)}, ensure_ascii=False))
+                if after_stage is not None and error is None:
+                    try:
+                        after_stage(stage.name)
+                    except Exception as e:
+                        error = e
+    finally:
+        pool.shutdown(wait=True)
+
+    print_report(report)
+    if error is not None:
+        raise error
+    if state_dir and not keep_state:
+        shutil.rmtree(state_dir, ignore_errors=True)
+    return outputs, report
+
+
+def _run_stage(stage, args):
+    with span(stage.name, "pipeline"):
+        return stage.fn(*args)
@@ -0,0 +1,207 @@
+import re
+import math
+import textwrap
+from array import array
+
+# estilo por defecto de ffmpeg al convertir SRT -> ASS (libavcodec/ass.h): los
+# tamaños de force_style se interpretaban sobre este lienzo de 384x288
+PLAY_RES = (384, 288)
+ASS_STYLE = {"Fontname": "Arial", "Fontsize": 16, "Outline": 1, "Shadow": 0,
+             "MarginL": 10, "MarginR": 10, "MarginV": 10}
+
+_SRT_TIME = re.compile(r"(\d+):(\d+):(\d+),(\d+)\s*-->\s*(\d+):(\d+):(\d+),(\+?\d+)")
+
+
+def _ts(t):
+    # t en segundos -> "HH:MM:SS,mmm" (redondeo en ms totales: 1.9996 -> 00:00:02,000)
+    total_ms = int(round(t * 1000))
+    s, ms = divmod(total_ms, 1000)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def _ass_ts(t):
+    # t en segundos -> "H:MM:SS.cc" (centésimas, como pide ASS)
+    total_cs = int(round(t * 100))
+    s, cs = divmod(total_cs, 100)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return f"{h:d}:{m:02d}:{s:02d}.{cs:02d}"
+
+
+def _ass_text(text):
+    # llaves abren tags de override en ASS; los saltos de línea son \N. Una
+    # barra invertida del texto lleva un word joiner detrás (invisible): así
+    # "\N" o "\h" de la transcripción se ven tal cual y no son overrides
+    return (text.strip().replace("\\", "\\\u2060").replace("{", r"\{").replace("}", r"\}")
+            .replace("\r", "").replace("\n", r"\N"))
+
+
+class Cues:
+    """
+    Cues de subtítulos en arrays paralelos (start/end en segundos, text).
+    Pasan en memoria por palabra/envoltura y se escriben una sola vez
+    (to_ass para el burn, to_srt si hace falta un archivo SRT).
+    """
+
+    __slots__ = ("start", "end", "text")
+
+    def __init__(self):
+        self.start = array("d")
+        self.end = array("d")
+        self.text = []
+
+    def __len__(self):
+        return len(self.text)
+
+    def __iter__(self):
+        return zip(self.start, self.end, self.text)
+
+    def append(self, start, end, text):
+        self.start.append(start)
+        self.end.append(end)
+        self.text.append(text)
+
+    def segments(self):
+        return [{"start": s, "end": e, "text": t} for s, e, t in self]
+
+    # --- construcción ---
+
+    @classmethod
+    def from_segments(cls, segs):
+        """Un cue por segmento [{start, end, text}]."""
+        cues = cls()
+        for seg in segs:
+            cues.append(seg["start"], seg["end"], seg["text"].strip())
+        return cues
+
+    @classmethod
+    def from_words(cls, segs, min_dur=0.12):
+        """
+        Palabra-a-palabra desde la salida de transcribe() (tiempos reales).
+        - min_dur: fusiona palabras demasiado cortas para que no “parpadee”
+        """
+        cues = cls()
+        for seg in segs:
+            words = seg.get("words") or []
+            if not words:
+                # fallback: un cue por segmento
+                cues.append(seg["start"], seg["end"], seg["text"].strip())
+                continue
+            # fusiona palabras demasiado cortas
+            buf = []
+            for w in words:
+                buf.append(w)
+                # si el último bloque es muy corto, espera sumar otra palabra
+                if buf[-1]["end"] - buf[0]["start"] >= min_dur:
+                    cues.append(buf[0]["start"], buf[-1]["end"],
+                                " ".join(x["word"] for x in buf).strip())
+                    buf = []
+            if buf:
+                cues.append(buf[0]["start"], buf[-1]["end"],
+                            " ".join(x["word"] for x in buf).strip())
+        return cues
+
+    @classmethod
+    def split_words(cls, segs, words_per_chunk=1, min_dur=0.12):
+        """
+        Cues a nivel palabra repartiendo el tiempo del segmento (sin tiempos por palabra).
+        - words_per_chunk: cuántas palabras por cue (1 = una palabra)
+        - min_dur: duración mínima por cue (seg); si no se llega, agrupa más palabras.
+        """
+        cues = cls()
+        for s in segs:
+            t0, t1 = s["start"], s["end"]
+            dur = max(0.01, t1 - t0)
+            # separa por espacios y quita comas/puntos del extremo
+            tokens = [c for c in (tok.strip(".,;:!?¡¿()[]«»\"'") for tok in s["text"].split()) if c]
+            if not tokens:
+                continue
+            # si la duración por palabra < min_dur, agrupar automáticamente
+            base_dt = dur / len(tokens)
+            auto_group = max(1, math.ceil(min_dur / max(base_dt, 1e-6)))
+            group = max(1, words_per_chunk, auto_group)
+            n_cues = math.ceil(len(tokens) / group)
+            cue_dt = dur / n_cues
+            for k in range(n_cues):
+                start = t0 + k * cue_dt
+                cues.append(start, min(t1, start + cue_dt),
+                            " ".join(tokens[k * group: (k + 1) * group]))
+        return cues
+
+    @classmethod
+    def from_srt(cls, path):
+        """Lee un SRT existente (el texto de cada cue queda en una línea)."""
+        cues = cls()
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            blocks = re.split(r"\n\s*\n", f.read().replace("\r\n", "\n"))
+        for block in blocks:
+            lines = block.strip("\n").split("\n")
+            if len(lines) < 2:
+                continue
+            m = _SRT_TIME.search(lines[1])
+            if not m:
+                continue
+            hh, mm, ss, ms, HH, MM, SS, MS = map(int, m.groups())
+            cues.append(hh * 3600 + mm * 60 + ss + ms / 1000,
+                        HH * 3600 + MM * 60 + SS + MS / 1000,
+                        " ".join(x.strip() for x in lines[2:] if x.strip()))
+        return cues
+
+    # --- transformaciones ---
+
+    def wrapped(self, max_chars=30, max_lines=2):
+        """Copia con el texto envuelto a `max_chars` y como mucho `max_lines` líneas."""
+        out = Cues()
+        out.start = array("d", self.start)
+        out.end = array("d", self.end)
+        for text in self.text:
+            lines = textwrap.wrap(text, width=max_chars) or [""]
+            if len(lines) > max_lines:
+                # junta el resto en la última
+                lines = lines[:max_lines - 1] + [" ".join(lines[max_lines - 1:])]
+            out.text.append("\n".join(lines))
+        return out
+
+    # --- salida ---
+
+    def to_srt(self, path):
+        lines = []
+        for idx, (s, e, t) in enumerate(self, 1):
+            lines += [str(idx), f"{_ts(s)} --> {_ts(e)}", t, ""]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        return path
+
+    def to_ass(self, path, **style):
+        """
+        .ass con el estilo ya aplicado (mismas claves que force_style:
+        Fontsize, Outline, Shadow, MarginV...): libass lo carga tal cual,
+        sin convertir SRT ni pisar el estilo cue por cue.
+        """
+        st = {**ASS_STYLE, **style}
+        head = [
+            "[Script Info]",
+            "ScriptType: v4.00+",
+            f"PlayResX: {PLAY_RES[0]}",
+            f"PlayResY: {PLAY_RES[1]}",
+            "ScaledBorderAndShadow: yes",
+            "YCbCr Matrix: None",
+            "",
+            "[V4+ Styles]",
+            "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, "
+            "BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, "
+            "BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+            f"Style: Default,{st['Fontname']},{st['Fontsize']},&H00FFFFFF,&H00FFFFFF,&H00000000,"
+            f"&H00000000,0,0,0,0,100,100,0,0,1,{st['Outline']},{st['Shadow']},2,"
+            f"{st['MarginL']},{st['MarginR']},{st['MarginV']},1",
+            "",
+            "[Events]",
+            "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+        ]
+        events = [f"Dialogue: 0,{_ass_ts(s)},{_ass_ts(e)},Default,,0,0,0,,{_ass_text(t)}"
+                  for s, e, t in self]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(head + events) + "\n")
+        return path
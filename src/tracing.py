@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+# traza del render actual (por contexto: renders en paralelo del daemon no se mezclan)
+_TRACE = ContextVar("shortauto_trace", default=None)
+_SPAN = ContextVar("shortauto_span", default=None)
+
+
+class Trace:
+    """Eventos "X" (duración) del formato trace-event de Chrome/Perfetto."""
+
+    def __init__(self, name="render"):
+        self.name = name
+        self.events = []
+        self.t0 = time.perf_counter_ns()
+        self.lock = threading.Lock()
+        self.threads = {}
+
+    def add(self, name, cat, start_ns, end_ns, args):
+        tid = threading.get_ident()
+        with self.lock:
+            self.threads.setdefault(tid, threading.current_thread().name)
+            self.events.append({
+                "name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": tid,
+                "ts": (start_ns - self.t0) / 1000, "dur": (end_ns - start_ns) / 1000,
+                "args": args,
+            })
+
+    def to_json(self):
+        meta = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                 "args": {"name": tname}} for tid, tname in self.threads.items()]
+        meta.append({"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0,
+                     "args": {"name": self.name}})
+        return {"traceEvents": meta + self.events, "displayTimeUnit": "ms"}
+
+    def write(self, path):
+        from src.cache import write_atomic  # src.cache importa este módulo
+        write_atomic(path, json.dumps(self.to_json(), ensure_ascii=False))
+        return path
+
+    def summary(self):
+        """Tabla por nombre de span: n, total, máx, bytes y hits/misses del cache."""
+        rows = {}
+        for e in self.events:
+            r = rows.setdefault(e["name"], {"cat": e["cat"], "n": 0, "total_s": 0.0, "max_s": 0.0,
+                                            "bytes": 0, "hit": 0, "miss": 0})
+            dur = e["dur"] / 1e6
+            r["n"] += 1
+            r["total_s"] += dur
+            r["max_s"] = max(r["max_s"], dur)
+            r["bytes"] += int(e["args"].get("bytes") or 0)
+            cache = e["args"].get("cache")
+            if cache == "miss" or cache == "api":
+                r["miss"] += 1
+            elif cache:
+                r["hit"] += 1
+        return rows
+
+    def print_summary(self):
+        rows = sorted(self.summary().items(), key=lambda kv: -kv[1]["total_s"])
+        print(f"[trace] {'span':<22} {'n':>4} {'total s':>9} {'máx s':>8} {'MB':>8} {'hit/miss':>9}")
+        for name, r in rows:
+            cache = f"{r['hit']}/{r['miss']}" if r["hit"] or r["miss"] else ""
+            mb = f"{r['bytes'] / 1e6:.1f}" if r["bytes"] else ""
+            print(f"[trace] {name:<22} {r['n']:>4} {r['total_s']:>9.2f} {r['max_s']:>8.2f} "
+                  f"{mb:>8} {cache:>9}")
+
+
+@contextmanager
+def tracing(path=None, name="render"):
+    """Activa una traza para lo que corra adentro; al salir la escribe y resume."""
+    trace = Trace(name)
+    token = _TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _TRACE.reset(token)
+        if path:
+            trace.write(path)
+            print(f"[trace] {path} ({len(trace.events)} eventos, abrir en ui.perfetto.dev)")
+        trace.print_summary()
+
+
+@contextmanager
+def span(name, cat="stage", **args):
+    """Mide un tramo (no hace nada si no hay traza activa)."""
+    trace = _TRACE.get()
+    if trace is None:
+        yield args
+        return
+    token = _SPAN.set(args)
+    start = time.perf_counter_ns()
+    try:
+        yield args
+    except BaseException as e:
+        args["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        trace.add(name, cat, start, time.perf_counter_ns(), args)
+        _SPAN.reset(token)
+
+
+def annotate(**kw):
+    """Agrega datos al span abierto más interno (p.ej. cache="hit", bytes=n)."""
+    args = _SPAN.get()
+    if args is not None:
+        for k, v in kw.items():
+            args[k] = args.get(k, 0) + v if k == "bytes" else v
+
+
+def submit(pool, fn, *args):
+    # pool.submit que hereda la traza activa (los hilos del pool no la ven solos)
+    return pool.submit(copy_context().run, fn, *args)
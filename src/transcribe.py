@@ -0,0 +1,93 @@
+import json
+import threading
+from src.cache import CACHE_ROOT, file_sha256, write_atomic
+from src.tracing import annotate
+
+TRANSCRIPT_DIR = CACHE_ROOT / "transcripts"
+TRANSCRIPT_VERSION = 1  # subir si cambia el formato guardado
+
+_MODELS = {}  # (size, device, compute_type) -> WhisperModel
+_MODELS_LOCK = threading.Lock()
+
+
+def get_whisper_model(model_size="medium", device="cpu", compute_type="int8", num_workers=1):
+    """
+    WhisperModel cargado una sola vez por proceso (por combinación de opciones).
+    num_workers sólo cuenta en la primera carga (transcripciones en paralelo).
+    """
+    key = (model_size, device, compute_type)
+    with _MODELS_LOCK:
+        if key not in _MODELS:
+            from faster_whisper import WhisperModel  # import pesado: sólo si hay que transcribir
+            print(f"[whisper] cargando modelo {model_size} ({device}/{compute_type})…")
+            _MODELS[key] = WhisperModel(model_size, device=device, compute_type=compute_type,
+                                        num_workers=num_workers)
+        return _MODELS[key]
+
+
+def transcript_key(audio_path, model_size, language, compute_type, vad_filter):
+    """Clave del cache: hash del contenido del audio + opciones de decodificación."""
+    return "-".join([
+        file_sha256(audio_path)[:32],
+        model_size, language or "auto", compute_type,
+        "vad" if vad_filter else "novad",
+        f"v{TRANSCRIPT_VERSION}",
+    ])
+
+
+def transcribe(audio_path, model_size="medium", language="es", device="cpu",
+               compute_type="int8", vad_filter=True, use_cache=True):  # usa "cuda" si tienes GPU
+    """
+    Una sola pasada de faster-whisper con tiempos por palabra.
+    Devuelve [{start, end, text, words: [{start, end, word}]}]: sirve para las
+    escenas y para los subtítulos (por frase o palabra-a-palabra).
+    Cacheado en .cache/transcripts por hash del audio y opciones: si la voz
+    no cambió, no se carga Whisper.
+    """
+    return list(transcribe_stream(audio_path, model_size, language, device, compute_type,
+                                  vad_filter, use_cache))
+
+
+def transcribe_stream(audio_path, model_size="medium", language="es", device="cpu",
+                      compute_type="int8", vad_filter=True, use_cache=True):
+    """
+    Igual que transcribe() pero como generador: cada segmento sale apenas
+    Whisper lo decodifica (el resto del audio se sigue procesando después).
+    El cache se escribe cuando se consumió la transcripción completa.
+    """
+    key = transcript_key(audio_path, model_size, language, compute_type, vad_filter)
+    path = TRANSCRIPT_DIR / f"{key}.json"
+    if use_cache and path.exists():
+        try:
+            out = json.loads(path.read_text(encoding="utf-8"))["segments"]
+        except Exception:
+            out = None  # entrada corrupta: se vuelve a transcribir
+        if out is not None:
+            print(f"[whisper] transcripción cacheada: {path.name}")
+            annotate(cache="hit")
+            yield from out
+            return
+
+    annotate(cache="miss")
+    model = get_whisper_model(model_size, device, compute_type)
+    segments, info = model.transcribe(
+        audio_path,
+        language=language,
+        vad_filter=vad_filter,
+        word_timestamps=True,
+    )
+    out = []
+    for seg in segments:  # faster-whisper decodifica de a poco mientras se itera
+        words = getattr(seg, "words", None) or []
+        item = {
+            "start": float(seg.start),
+            "end": float(seg.end),
+            "text": seg.text.strip(),
+            "words": [{"start": float(w.start), "end": float(w.end), "word": w.word} for w in words],
+        }
+        out.append(item)
+        yield item
+    print(f"[whisper] {len(out)} segmentos ({info.duration:.1f}s de audio)")
+    if use_cache:
+        write_atomic(path, json.dumps({"key": key, "audio": str(audio_path), "segments": out},
+                                      ensure_ascii=False))
@@ -1,12 +1,22 @@
 from pathlib import Path
-import os, re, math, random, unicodedata,datetime, pprint
-import requests, time
-from dotenv import load_dotenv
-from moviepy.editor import VideoFileClip, AudioFileClip, ColorClip, concatenate_videoclips, vfx
-from moviepy.editor import ImageClip  # <-- NUEVO
+import os, re, math, random, unicodedata, pprint
+import time
+import queue
+import hashlib
+import threading
+from contextvars import ContextVar, copy_context
 from glob import glob                 # <-- NUEVO
-from sentence_transformers import SentenceTransformer, util
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from src.image_ai import generate_image_hf
+from src.env import env
+from src.embeddings import encode, lookup_word_vectors, store_word_vectors, top_k_per_scene
+from src.render import (W, H, FPS, BITRATE, probe_media, ff_threads, compose_scenes_ffmpeg,
+                        encode_scene)
+from src.cache import (cached_download, broll_cache_report, cached_search,
+                       reset_search_memo, search_cache_report)
+from src.library import match_scenes
+from src.tracing import span, annotate, submit
+from src import net
 
 
 
@@ -19,24 +29,22 @@ def dlog(*args):
     if DEBUG:
         print(*args)
 
-AUDIT = {
-    "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
-    "scenes": []
-}
-
 LOCAL_ASSETS = glob("assets/*.mp4")   # fallback de clips locales (opcional)
 
 
+PEXELS_API = env("PEXELS_API_BASE", "https://api.pexels.com").rstrip("/")
 UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124 Safari/537.36"
 
-# --- CONFIG ---
-W, H = 1080, 1920
-FPS = 30
-BITRATE = "6000k"
+# --- CONFIG --- (W, H, FPS y BITRATE vienen de src/render.py)
 BG_COLOR = (0,0,0)  # fallback si no hay b-roll
 SEARCH_PER_SEG = 1  # 1 clip por segmento
-
-_EMB_MODEL = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+BROLL_WORKERS = int(env("BROLL_WORKERS", "8"))  # búsquedas/descargas en paralelo
+PARTIAL_DOWNLOADS = env("PEXELS_PARTIAL", "0") == "1"  # bajar sólo el comienzo del video
+PARTIAL_MARGIN_S = 2.0            # segundos extra sobre la escena más larga
+PARTIAL_PAD_BYTES = 512 * 1024    # colchón (moov + GOP en curso)
+# link de Pexels -> {duration, width, height} (para descargas parciales); uno
+# por render (ContextVar): con el daemon no se mezclan ni crecen sin límite
+VIDEO_META = ContextVar("video_meta", default=None)
 
 STOP_ES = set("""
 a al algo algunas algunos ante antes aquel aquella aquellas aquellos 
@@ -51,9 +59,6 @@ esas ese eso esos esta estaba estaban estás este esto estos fin
    uno unos vuestra vuestras vuestro vuestros y ya
 """.split())
 
-load_dotenv()
-PEXELS_KEY = os.getenv("PEXELS_API_KEY")
-
 def _strip_accents(s: str) -> str:
     return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
 
@@ -71,20 +76,51 @@ def _candidate_words(text: str, max_words=30):
             break
     return out
 
+def scene_keywords(texts, top_k=3):
+    """
+    Top-k palabras más cercanas al embedding de cada frase, para TODAS las
+    escenas a la vez: frases + palabras nuevas en un solo encode (batch),
+    palabras ya vistas desde el store en disco, top-k con una matmul.
+    """
+    with span("keywords", scenes=len(texts)):
+        return _scene_keywords(texts, top_k)
+
+
+def _scene_keywords(texts, top_k):
+    import numpy as np
+    cands = [_candidate_words(t) for t in texts]
+    vocab = list(dict.fromkeys(w for ws in cands for w in ws))
+    if not vocab:
+        return [[t.strip()][:top_k] for t in texts]
+
+    found, missing = lookup_word_vectors(vocab)
+    annotate(words=len(vocab), embedded=len(missing))
+    with_words = [i for i, ws in enumerate(cands) if ws]
+    embs = encode([texts[i] for i in with_words] + missing)
+    scene_vecs, new_vecs = embs[:len(with_words)], embs[len(with_words):]
+    store_word_vectors(missing, new_vecs)
+    found.update(zip(missing, new_vecs))
+
+    word_vecs = np.stack([found[w] for w in vocab])
+    pos = {w: j for j, w in enumerate(vocab)}
+    tops = top_k_per_scene(scene_vecs, word_vecs,
+                           [[pos[w] for w in cands[i]] for i in with_words], top_k=top_k)
+
+    out = [[t.strip()][:top_k] for t in texts]  # sin candidatas: la frase tal cual
+    for i, idxs in zip(with_words, tops):
+        out[i] = [vocab[j] for j in idxs]
+    return out
+
+
 def visual_keywords(text: str, top_k=3):
     """Top-k palabras más cercanas al embedding de la frase."""
-    words = _candidate_words(text)
-    if not words:
-        return [text.strip()][:top_k]
-    emb_text = _EMB_MODEL.encode(text, convert_to_tensor=True, normalize_embeddings=True)
-    emb_words = _EMB_MODEL.encode(words, convert_to_tensor=True, normalize_embeddings=True)
-    sims = util.cos_sim(emb_text, emb_words)[0]  # (N,)
-    idxs = sims.argsort(descending=True)[:top_k].tolist()
-    return [words[i] for i in idxs]
-
-def build_queries_for_phrase_embeddings(text: str, top_k=3, max_out=8):
+    return scene_keywords([text], top_k=top_k)[0]
+
+
+def build_queries_for_phrase_embeddings(text: str, top_k=3, max_out=8, kws=None):
     """Arma queries: palabras sueltas + combos cortos + fallback frase completa."""
-    kws = visual_keywords(text, top_k=top_k)
+    if kws is None:
+        kws = visual_keywords(text, top_k=top_k)
     queries = []
     queries.extend(kws)                       # "sangre", "glucosa", "laboratorio"
     if len(kws) >= 2: queries.append(" ".join(kws[:2]))   # "sangre glucosa"
@@ -102,23 +138,46 @@ def build_queries_for_phrase_embeddings(text: str, top_k=3, max_out=8):
     # Log opcional (si querés ver qué se manda)
     print(f"[emb] kws={kws} → queries={out}")
     return out
+
+
+def build_queries_for_scenes(texts, top_k=3, max_out=8):
+    """Queries de todas las escenas con un solo pase de embeddings."""
+    all_kws = scene_keywords(texts, top_k=top_k)
+    return [build_queries_for_phrase_embeddings(t, top_k, max_out, kws=k)
+            for t, k in zip(texts, all_kws)]
 # --- FIN NUEVO ---
 
-def make_photo_clip(img_path, dur, zoom_end=1.08):
-    # Carga, adapta a 1080x1920 y aplica zoom suave (Ken Burns)
+def make_photo_clip(img_path, dur, zoom_end=1.08, out=None):
+    """
+    Foto 1080x1920 con zoom suave (Ken Burns).
+    - con `out`: ffmpeg zoompan renderiza la escena a ese mp4 (nativo) y se
+      abre como clip; si falla, cae al zoom por frame de moviepy
+    """
+    from moviepy.editor import ImageClip, VideoFileClip
+    if out:
+        try:
+            encode_scene({"kind": "photo", "path": img_path, "dur": dur, "zoom_end": zoom_end}, out)
+            return VideoFileClip(out)
+        except Exception as e:
+            print(f"[warn] zoompan falló ({img_path}), uso moviepy: {e}")
     base = ImageClip(img_path).set_duration(dur)
     base = fit_image_vertical(base)
     # zoom de 1.00 -> 1.08 en 'dur' segundos
     kz = lambda t: 1.0 + (zoom_end - 1.0) * (t / max(dur, 1e-6))
     return base.resize(kz)
 
+def _pexels_get(url, params):
+    r = net.get(url, headers={"Authorization": env("PEXELS_API_KEY")}, params=params, timeout=20)
+    r.raise_for_status()
+    return r.json()
+
+
 def pexels_photos_search(q, n=5):
-    if not PEXELS_KEY: return []
-    url = "https://api.pexels.com/v1/search"
+    if not env("PEXELS_API_KEY"): return []
+    url = f"{PEXELS_API}/v1/search"
     params = {"query": q, "per_page": n, "orientation": "portrait", "size": "large"}
-    r = requests.get(url, headers={"Authorization": PEXELS_KEY}, params=params, timeout=20)
-    r.raise_for_status()
-    photos = r.json().get("photos", [])
+    data = cached_search("pexels_photos", params, lambda p: _pexels_get(url, p))
+    photos = data.get("photos", [])
     out = []
     for p in photos:
         src = p.get("src", {})
@@ -127,23 +186,40 @@ def pexels_photos_search(q, n=5):
 
 
 def pexels_search(q, n=5):  # antes n=1
-    if not PEXELS_KEY: return []
-    url = "https://api.pexels.com/videos/search"
+    if not env("PEXELS_API_KEY"): return []
+    url = f"{PEXELS_API}/videos/search"
     params = {"query": q, "per_page": n, "orientation": "portrait", "size": "large"}
     dlog(f"[pexels] videos query='{q}' params={params}")
-    r = requests.get(url, headers={"Authorization": PEXELS_KEY}, params=params, timeout=20)
-    r.raise_for_status()
-    vids = r.json().get("videos", [])
+    data = cached_search("pexels_videos", params, lambda p: _pexels_get(url, p))
+    vids = data.get("videos", [])
     dlog(f"[pexels] videos encontrados: {len(vids)}")
     out = []
+    meta = VIDEO_META.get()
     for v in vids:
         files = [f for f in v.get("video_files", []) if f.get("file_type","").startswith("video/")]
-        files.sort(key=lambda f: (f.get("height",0), f.get("bitrate",0)), reverse=True)
-        for f in files:
+        for f in pick_video_files(files):
             out.append(f["link"])
+            if meta is not None:
+                meta[f["link"]] = {"duration": v.get("duration"),
+                                   "width": f.get("width"), "height": f.get("height")}
     return out  # devolvemos varias opciones
 
 
+def pick_video_files(files, w=W, h=H):
+    """
+    Renditions en orden de preferencia: primero las que cubren w x h sin
+    escalar hacia arriba, de la más chica a la más grande (no bajar un 4K
+    para reducirlo a 1080x1920); después el resto, de la más grande a la más chica.
+    """
+    def dims(f):
+        return (f.get("width") or 0), (f.get("height") or 0)
+    cover = [f for f in files if dims(f)[0] >= w and dims(f)[1] >= h]
+    cover.sort(key=lambda f: (dims(f)[0] * dims(f)[1], f.get("bitrate") or 0))
+    rest = [f for f in files if not (dims(f)[0] >= w and dims(f)[1] >= h)]
+    rest.sort(key=lambda f: (dims(f)[1], f.get("bitrate") or 0), reverse=True)
+    return cover + rest
+
+
 def fit_image_vertical(image_clip):
     c = image_clip.resize(height=H)
     if c.w < W:
@@ -152,28 +228,100 @@ def fit_image_vertical(image_clip):
     return c.crop(width=W, height=H, x_center=x_center, y_center=y_center)
 
 
-def download(url, out, max_retries=3):
+def download(url, out, max_retries=3, max_bytes=None):
+    """
+    Descarga reanudable a `out`: si ya tiene bytes (un .part de antes o un
+    intento cortado) pide el resto con Range en vez de empezar de cero.
+    - max_bytes: cortar al llegar a esa cantidad (descarga parcial)
+    - acá sólo se reintentan los cortes a mitad del cuerpo; los errores de
+      conexión, 408/429 y 5xx ya los reintenta net y el resto de 4xx no se
+      arregla reintentando
+    """
+    import requests
     last_err = None
-    for _ in range(max_retries):
+    for attempt in range(max_retries):
+        streaming = False
+        have = os.path.getsize(out) if os.path.exists(out) else 0
+        if max_bytes and have >= max_bytes:
+            return out
+        # Algunos CDNs de Pexels exigen Referer/UA “de navegador”
+        headers = {"User-Agent": UA, "Referer": "https://www.pexels.com/"}
+        if have or max_bytes:
+            headers["Range"] = f"bytes={have}-{max_bytes - 1 if max_bytes else ''}"
         try:
-            # Algunos CDNs de Pexels exigen Referer/UA “de navegador”
-            with requests.get(
-                url,
-                headers={"User-Agent": UA, "Referer": "https://www.pexels.com/"},
-                stream=True,
-                timeout=60,
-                allow_redirects=True,
-            ) as r:
+            with net.get(url, headers=headers, stream=True, timeout=60,
+                         retry_status=net.RETRY_STATUS + (408,)) as r:
+                if r.status_code == 416 and have:
+                    return out  # ya estaba completo
                 r.raise_for_status()
-                with open(out, "wb") as f:
+                streaming = True
+                if have and r.status_code != 206:
+                    have = 0  # el server ignoró el Range: desde cero
+                written = have
+                with open(out, "ab" if have else "wb") as f:
                     for chunk in r.iter_content(chunk_size=1 << 20):
-                        if chunk:
-                            f.write(chunk)
+                        if not chunk:
+                            continue
+                        if max_bytes:
+                            chunk = chunk[:max_bytes - written]
+                        f.write(chunk)
+                        written += len(chunk)
+                        annotate(bytes=len(chunk))
+                        if max_bytes and written >= max_bytes:
+                            break
             return out
-        except requests.HTTPError as e:
+        except requests.RequestException as e:
+            if not streaming:
+                raise  # net ya hizo sus reintentos (o es un 4xx): no se apilan
+            # corte a mitad de camino: se reanuda con Range
             last_err = e
+            time.sleep(net.backoff_delay(attempt))
     raise last_err or RuntimeError(f"no se pudo descargar {url}")
 
+
+def _moov_first(path):
+    # mp4 "faststart" (moov antes que mdat): el comienzo se decodifica sin el resto
+    import struct
+    with open(path, "rb") as f:
+        while True:
+            hdr = f.read(8)
+            if len(hdr) < 8:
+                return False
+            size, typ = struct.unpack(">I4s", hdr)
+            if typ == b"moov":
+                return True
+            if typ == b"mdat" or size == 0:
+                return False
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0] - 8
+            f.seek(size - 8, 1)
+
+
+def _content_length(url):
+    r = net.head(url, headers={"User-Agent": UA, "Referer": "https://www.pexels.com/"},
+                 timeout=20)
+    r.raise_for_status()
+    return int(r.headers.get("Content-Length") or 0)
+
+
+def download_head(url, out, need_s):
+    """
+    Baja sólo lo necesario para los primeros `need_s` segundos del video
+    (proporcional a la duración de Pexels + margen). Si el mp4 no es
+    faststart, un pedazo no sirve: se completa la descarga (reanudando).
+    """
+    dur = ((VIDEO_META.get() or {}).get(url) or {}).get("duration") or 0
+    size = _content_length(url) if dur > need_s else 0
+    if not size:
+        return download(url, out)
+    max_bytes = int(size * need_s / dur) + PARTIAL_PAD_BYTES
+    download(url, out, max_bytes=max_bytes)
+    if max_bytes < size and not _moov_first(out):
+        dlog(f"[pexels] {url} no es faststart, descarga completa")
+        return download(url, out)
+    return out
+
+
 def fit_vertical(clip):
     # escala y recorta a 1080x1920 manteniendo centro
     c = clip.resize(height=H)
@@ -196,111 +344,335 @@ def keywords_from_text(text, k=3):
     return uniq[:k]
 
 
-def build_video_from_segments(segs, audio_path="voz.mp3"):
-    tmp_dir = Path("tmp_broll"); tmp_dir.mkdir(exist_ok=True)
-    clips = []
-    used_urls = set()   # ← SOLO para este render (videos y fotos)
-    last_ok_clip = None  # para reusar si falla
+def _loop_to(clip, dur):
+    # repite el clip hasta cubrir 'dur' y recorta
+    from moviepy.editor import concatenate_videoclips
+    if clip.duration < dur:
+        reps = math.ceil(dur / clip.duration)
+        return concatenate_videoclips([clip]*reps).subclip(0, dur)
+    return clip.subclip(0, dur)
 
-    for i, s in enumerate(segs):
-        dur = max(1.2, s["end"] - s["start"])  # subo mínimo a 1.2s
-        queries = build_queries_for_phrase_embeddings(s["text"], top_k=3, max_out=8)
 
-        base = None
+_PENDING = object()  # marcador: búsqueda/descarga todavía no resuelta
 
 
-        # === IA FIRST SCENE (sólo primera frase) ===
-        if i == 0:
-            try:
-                ia_path = generate_image_hf(s["text"], out_path=str(tmp_dir / "ia_first.jpg"))
-                base = make_photo_clip(ia_path, dur)  # tu helper para fotos → clip
-                print("[ia] Imagen generada para la primera frase")
-            except Exception as e:
-                print("[warn] IA image failed:", e)
-        # === /IA FIRST SCENE ===
+def _search_task(kind, q):
+    # devuelve [] si falla, igual que el loop serial original
+    with span("search", "net", kind=kind, query=q) as sp:
+        try:
+            urls = pexels_search(q, n=5) if kind == "video" else pexels_photos_search(q, n=5)
+        except Exception as e:
+            print(f"[warn] pexels {kind}:", e)
+            urls = []
+        sp["results"] = len(urls)
+        return urls
 
-        # ==== VIDEOS ====
-        for q in queries:
-            try:
-                urls = pexels_search(q, n=5)
-            except Exception as e:
-                print("[warn] pexels:", e); urls = []
-
-            # no repetir dentro del mismo render
-            urls = [u for u in urls if u not in used_urls]
-
-            for j, url in enumerate(urls):
-                local = tmp_dir / f"seg{i}_{j}.mp4"
-                try:
-                    download(url, str(local))
-                    cand = VideoFileClip(str(local))
-                    cand = fit_vertical(cand)
-                    if cand.duration < dur:
-                        reps = math.ceil(dur / cand.duration)
-                        cand = concatenate_videoclips([cand]*reps).subclip(0, dur)
-                    else:
-                        cand = cand.subclip(0, dur)
-                    base = cand
-                    used_urls.add(url)  # ← marcar como usado
-                    break
-                except Exception as e:
-                    print(f"[warn] fallo descarga/clip ({url}): {e}")
-            if base: break
-
-        if base is None:
-            photo_base = None
-            for q in queries:
-                try:
-                    purls = pexels_photos_search(q, n=5)
-                except Exception as e:
-                    print("[warn] pexels photos:", e); purls = []
-
-                purls = [u for u in purls if u not in used_urls]  # ← filtrar
-
-                for j, purl in enumerate(purls):
-                    local_img = tmp_dir / f"seg{i}_{j}.jpg"
-                    try:
-                        download(purl, str(local_img))
-                        photo_base = make_photo_clip(str(local_img), dur)
-                        used_urls.add(purl)  # ← marcar como usada
-                        break
-                    except Exception as e:
-                        print(f"[warn] fallo foto ({purl}): {e}")
-                if photo_base: break
-
-            if photo_base:
-                base = photo_base
-        # Fallbacks sólidos para evitar negro
-        if base is None and last_ok_clip is not None:
-            # reusar el último clip válido
-            cand = last_ok_clip
-            if cand.duration < dur:
-                reps = math.ceil(dur / cand.duration)
-                cand = concatenate_videoclips([cand]*reps).subclip(0, dur)
+
+def _fetch_task(kind, url, need_s=None):
+    # descarga (cacheada) + validación; None si falla
+    with span("download", "net", kind=kind, url=url) as sp:
+        try:
+            if kind == "video" and PARTIAL_DOWNLOADS and need_s:
+                need_s = math.ceil(need_s + PARTIAL_MARGIN_S)
+                local = cached_download(url, ".mp4", lambda u, o: download_head(u, o, need_s),
+                                        variant=f"head={need_s}s")
             else:
-                cand = cand.subclip(0, dur)
-            base = cand
-        if base is None and LOCAL_ASSETS:
+                local = cached_download(url, ".mp4" if kind == "video" else ".jpg", download)
+            probe_media(local)  # valida que se pueda decodificar
+            return local
+        except Exception as e:
+            print(f"[warn] fallo descarga/clip ({url}): {e}")
+            sp["error"] = str(e)
+            return None
+
+
+def _ia_task(text, tmp_dir):
+    with span("ia_image", "net") as sp:
+        try:
+            ia_path = generate_image_hf(text, out_path=str(tmp_dir / "ia_first.jpg"))
+            print("[ia] Imagen generada para la primera frase")
+            return {"kind": "photo", "path": ia_path, "url": None}
+        except Exception as e:
+            print("[warn] IA image failed:", e)
+            sp["error"] = str(e)
+            return None
+
+
+def _plan_scenes(queries, searches, fetched, ia, library=None):
+    """
+    Aplica la cadena de prioridades escena por escena (en orden) con lo que
+    ya se sabe. Devuelve (picks, needs):
+    - library[i]: clip de la biblioteca propia para la escena (va primero, sin red)
+    - picks[i]: asset elegido o None (=> fallbacks)
+    - needs: tareas que faltan resolver ("search"/"fetch"/"ia")
+    Una descarga en curso se asume exitosa (especulación); si después falla,
+    la próxima pasada re-planifica. Sin `needs`, el plan es idéntico al serial.
+    """
+    used = set()
+    picks, needs = [], []
+
+    def walk(kind, qs):
+        for q in qs:
+            urls = searches.get((kind, q), _PENDING)
+            if urls is _PENDING:
+                needs.append(("search", kind, q))
+                return _PENDING
+            for url in urls:
+                if url in used:
+                    continue  # no repetir dentro del mismo render
+                local = fetched.get(url, _PENDING)
+                if local is None:
+                    continue
+                used.add(url)
+                if local is _PENDING:
+                    needs.append(("fetch", kind, url))
+                    return _PENDING
+                return {"kind": kind, "path": local, "url": url}
+        return None
+
+    for i, qs in enumerate(queries):
+        if library and library[i] is not None:
+            picks.append(library[i])
+            continue
+        ia_state = ia if i == 0 else None
+        if ia_state is _PENDING:
+            needs.append(("ia",))
+        # con imagen IA sólo se prueba la primera query (igual que antes)
+        pick = walk("video", qs[:1] if ia_state is not None else qs)
+        if pick is None and ia_state is not None:
+            pick = ia_state
+        if pick is None:
+            pick = walk("photo", qs)
+        picks.append(None if pick is _PENDING else pick)
+    return picks, needs
+
+
+_END = object()  # fin del stream de escenas
+
+
+class _SceneFeed:
+    """
+    Escenas que llegan de un iterador (p.ej. la transcripción en curso):
+    un hilo lo recorre y las va dejando en una cola; next_batch() devuelve
+    todas las que ya están listas (al menos una) con sus queries.
+    """
+
+    def __init__(self, scenes):
+        self.q = queue.Queue()
+        self.done = False
+        ctx = copy_context()  # la traza sigue al hilo
+        threading.Thread(target=ctx.run, args=(self._run, scenes),
+                         name="scene-feed", daemon=True).start()
+
+    def _run(self, scenes):
+        try:
+            for s in scenes:
+                self.q.put(s)
+            self.q.put(_END)
+        except BaseException as e:
+            self.q.put(e)
+
+    def next_batch(self):
+        with span("scene_wait", "stream"):
+            items = [self.q.get()]
+        while items[-1] is not _END and not isinstance(items[-1], BaseException):
             try:
-                cand = VideoFileClip(random.choice(LOCAL_ASSETS))
-                cand = fit_vertical(cand)
-                if cand.duration < dur:
-                    reps = math.ceil(dur / cand.duration)
-                    cand = concatenate_videoclips([cand]*reps).subclip(0, dur)
+                items.append(self.q.get_nowait())
+            except queue.Empty:
+                break
+        if isinstance(items[-1], BaseException):
+            raise items[-1]
+        if items[-1] is _END:
+            self.done = True
+            items.pop()
+        queries = build_queries_for_scenes([s["text"] for s in items], top_k=3, max_out=8) if items else []
+        return items, queries
+
+
+def resolve_scene_assets(segs, tmp_dir="tmp_broll", workers=None):
+    """
+    Elige el asset de cada escena (video, foto o color) sin armar clips.
+    Devuelve [{kind, path, url, dur, text}] en el orden de las escenas,
+    para que lo consuma moviepy o el render de una sola pasada con ffmpeg.
+    Búsquedas y descargas de todas las escenas corren en paralelo
+    (hasta `workers`, default BROLL_WORKERS); el resultado es el mismo
+    que recorriendo las escenas de a una.
+    - segs puede ser un iterador (escenas en streaming mientras Whisper
+      transcribe): cada escena se busca/descarga apenas llega
+    """
+    streaming = not isinstance(segs, (list, tuple))
+    with span("resolve_assets", streaming=streaming) as sp:
+        # contexto propio: el memo de búsquedas y VIDEO_META mueren con el render
+        assets = copy_context().run(_resolve_scene_assets, segs, tmp_dir, workers)
+        sp["scenes"] = len(assets)
+        return assets
+
+
+def _resolve_scene_assets(segs, tmp_dir, workers):
+    tmp_dir = Path(tmp_dir); tmp_dir.mkdir(exist_ok=True)
+    workers = workers or BROLL_WORKERS
+    reset_search_memo()  # cada query va a la API como mucho una vez por render
+    VIDEO_META.set({})   # las tareas del pool (submit) heredan este render
+    feed = None
+    lib_used = set()  # clips de la biblioteca ya elegidos (no se repiten)
+    if isinstance(segs, (list, tuple)):
+        segs = list(segs)
+        queries = build_queries_for_scenes([s["text"] for s in segs], top_k=3, max_out=8)
+        library = match_scenes([s["text"] for s in segs],
+                               [max(1.2, s["end"] - s["start"]) for s in segs], lib_used)
+    else:
+        feed, segs, queries, library = _SceneFeed(segs), [], [], []
+    # descargas parciales: alcanza con la escena más larga (todas usan el mismo
+    # largo); en streaming, la más larga de las que llegaron hasta ahora
+    need_s = max((max(1.2, s["end"] - s["start"]) for s in segs), default=0)
+
+    searches = {}   # (kind, query) -> [urls]
+    fetched = {}    # url -> ruta local validada | None (falló)
+    ia = None
+    ia_started = False
+    inflight = {}   # tarea -> future
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    feed_pool = ThreadPoolExecutor(max_workers=1) if feed else None
+    try:
+        if feed:
+            inflight[("scenes",)] = submit(feed_pool, feed.next_batch)
+
+        while True:
+            # === IA FIRST SCENE (sólo primera frase, si la biblioteca no la cubre) ===
+            if segs and not ia_started:
+                ia_started = True
+                if library[0] is None:
+                    ia = _PENDING
+                    inflight[("ia",)] = submit(pool, _ia_task, segs[0]["text"], tmp_dir)
+            picks, needs = _plan_scenes(queries, searches, fetched, ia, library)
+            if not needs and ("scenes",) not in inflight:
+                break
+            for task in needs:
+                if task in inflight:
+                    continue
+                if task[0] == "search":
+                    inflight[task] = submit(pool, _search_task, task[1], task[2])
+                elif task[0] == "fetch":
+                    inflight[task] = submit(pool, _fetch_task, task[1], task[2], need_s)
+            done, _ = wait(list(inflight.values()), return_when=FIRST_COMPLETED)
+            for task, fut in list(inflight.items()):
+                if fut not in done:
+                    continue
+                del inflight[task]
+                if task[0] == "search":
+                    searches[(task[1], task[2])] = fut.result()
+                elif task[0] == "fetch":
+                    fetched[task[2]] = fut.result()
+                elif task[0] == "scenes":
+                    batch, batch_queries = fut.result()
+                    segs += batch
+                    queries += batch_queries
+                    library += match_scenes([s["text"] for s in batch],
+                                            [max(1.2, s["end"] - s["start"]) for s in batch],
+                                            lib_used)
+                    need_s = max([need_s] + [max(1.2, s["end"] - s["start"]) for s in batch])
+                    if not feed.done:
+                        inflight[("scenes",)] = submit(feed_pool, feed.next_batch)
                 else:
-                    cand = cand.subclip(0, dur)
-                base = cand
+                    ia = fut.result()
+    finally:
+        # lo especulativo que ya no hace falta se cancela (lo que corre termina en el cache)
+        pool.shutdown(wait=True, cancel_futures=True)
+        if feed_pool:
+            feed_pool.shutdown(wait=False, cancel_futures=True)
+
+    assets = []
+    last_ok = None
+    for i, (s, pick) in enumerate(zip(segs, picks)):
+        dur = max(1.2, s["end"] - s["start"])  # subo mínimo a 1.2s
+        asset = dict(pick) if pick else None
+
+        # Fallbacks sólidos para evitar negro
+        if asset is None and last_ok is not None:
+            # reusar el último asset válido
+            asset = dict(last_ok)
+        if asset is None and LOCAL_ASSETS:
+            local = random.choice(LOCAL_ASSETS)
+            try:
+                probe_media(local)
+                asset = {"kind": "video", "path": local, "url": None}
             except Exception as e:
                 print("[warn] asset local falló:", e)
 
-        if base is None:
-            base = ColorClip((W, H), color=BG_COLOR, duration=dur)  # último recurso
+        if asset is None:
+            asset = {"kind": "color", "path": None, "url": None}  # último recurso
+
+        asset["dur"] = dur
+        asset["text"] = s["text"]
+        last_ok = asset
+        assets.append(asset)
+        lib = f" [biblioteca {asset['library_sim']}]" if "library_sim" in asset else ""
+        dlog(f"[scene {i}] {asset['kind']} {asset['path'] or ''} ({dur:.2f}s){lib}")
+
+    annotate(**{k: sum(a["kind"] == k for a in assets) for k in ("video", "photo", "color")},
+             library=sum(p is not None and "library_sim" in p for p in picks))
+    broll_cache_report()
+    search_cache_report()
+    return assets
 
-        last_ok_clip = base
-        clips.append(base)
+
+def asset_to_clip(asset, tmp_dir=None):
+    """
+    Convierte un asset de resolve_scene_assets en clip moviepy 1080x1920.
+    Las fotos se pre-renderizan con ffmpeg en tmp_dir/scenes (si se pasa).
+    """
+    with span("clip_open", kind=asset["kind"], path=asset["path"], dur=asset["dur"]):
+        return _asset_to_clip(asset, tmp_dir)
+
+
+def _asset_to_clip(asset, tmp_dir):
+    from moviepy.editor import VideoFileClip, ColorClip
+    dur = asset["dur"]
+    if asset["kind"] == "video":
+        try:
+            return _loop_to(fit_vertical(VideoFileClip(asset["path"])), dur)
+        except Exception as e:
+            print(f"[warn] no se pudo abrir {asset['path']}: {e}")
+    elif asset["kind"] == "photo":
+        try:
+            out = None
+            if tmp_dir is not None:
+                key = hashlib.sha1(f"{asset['path']}|{dur:.3f}".encode("utf-8")).hexdigest()[:16]
+                out = Path(tmp_dir) / "scenes" / f"photo-{key}.mp4"
+                out.parent.mkdir(parents=True, exist_ok=True)
+                out = str(out)
+            return make_photo_clip(asset["path"], dur, out=out)
+        except Exception as e:
+            print(f"[warn] no se pudo abrir {asset['path']}: {e}")
+    return ColorClip((W, H), color=BG_COLOR, duration=dur)
+
+
+def build_video_from_segments(segs, audio_path="voz.mp3", out="tmp_base.mp4", tmp_dir="tmp_broll",
+                              compositor="moviepy", assets=None, cues=None, sub_style=None):
+    """
+    Video base (escenas + voz) -> `out`.
+    - compositor="moviepy": clips en memoria + concatenate_videoclips (original)
+    - compositor="ffmpeg": cada escena normalizada por ffmpeg + concat demuxer
+    - assets: ya resueltos (resolve_scene_assets); si no, se resuelven de `segs`
+    - cues/sub_style (sólo ffmpeg): subtítulos quemados en cada escena
+    """
+    if assets is None:
+        assets = resolve_scene_assets(segs, tmp_dir=tmp_dir)
+    if compositor == "ffmpeg":
+        with span("encode", compositor="ffmpeg", scenes=len(assets)):
+            return compose_scenes_ffmpeg(assets, audio_path, out, tmp_dir=tmp_dir,
+                                         cues=cues, sub_style=sub_style)
+
+    from moviepy.editor import AudioFileClip, concatenate_videoclips, vfx
+    clips = [asset_to_clip(a, tmp_dir=tmp_dir) for a in assets]
 
     video = concatenate_videoclips(clips, method="compose")
     audio = AudioFileClip(audio_path)
     video = video.set_audio(audio).fx(vfx.fadein,0.1).fx(vfx.fadeout,0.1)
-    video.write_videofile("tmp_base.mp4", fps=FPS, codec="libx264", audio_codec="aac", bitrate=BITRATE)
-    return "tmp_base.mp4"
\ No newline at end of file
+    # temporal de audio junto al out (por defecto moviepy lo deja en el cwd)
+    tmp_audio = str(Path(out).with_name(Path(out).stem + "TEMP_MPY_wvf_snd.m4a"))
+    with span("encode", compositor="moviepy", scenes=len(assets)):
+        video.write_videofile(out, fps=FPS, codec="libx264", audio_codec="aac", bitrate=BITRATE,
+                              temp_audiofile=tmp_audio, threads=ff_threads())
+    return out